@@ -6,6 +6,7 @@ from . import settings
 class MassAdminConfig(AppConfig):
     name = 'massadmin'
     verbose_name = "Mass edit"
+    default_auto_field = 'django.db.models.AutoField'
 
     def ready(self):
         from .massadmin import mass_change_selected
@@ -0,0 +1,132 @@
+"""
+Per (admin site, model) caches of mass change views.
+
+``metadata_cache`` holds the field metadata used by mass change forms,
+``mass_admin_cache`` the prepared ``MassAdmin`` objects. Entries are built on
+first use and rebuilt when the model is registered again with another
+``ModelAdmin``. Field sets that depend on the request or on the edited object
+(fieldsets, readonly fields) are not cached.
+"""
+from collections import namedtuple
+from threading import Lock
+
+from django.db.models import FileField
+
+from .expressions import get_expression_fields
+
+ModelMetadata = namedtuple('ModelMetadata', [
+    'unique_fields',
+    'exclude_fields',
+    'm2m_fields',
+    'file_fields',
+    'editable_fields',
+    'numeric_fields',
+    'text_fields',
+])
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'invalidations', 'size'])
+
+
+class AdminCache:
+    """
+    Values built by `build(admin_site, model, *args)`, kept as long as the
+    model stays registered with the same ModelAdmin.
+    """
+
+    def __init__(self, build):
+        self.build = build
+        self.entries = {}
+        self.lock = Lock()
+        self.clear()
+
+    def get(self, admin_site, model, *args):
+        admin_obj = admin_site._registry.get(model)
+        key = (admin_site, model) + args
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] is admin_obj:
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                # the model was registered again
+                self.invalidations += 1
+            self.misses += 1
+            value = self.build(admin_site, model, *args)
+            self.entries[key] = (admin_obj, value)
+            return value
+
+    def invalidate(self, admin_site=None, model=None):
+        """Drops the entries of `admin_site` and/or `model`, all of them by default"""
+        with self.lock:
+            for key in list(self.entries):
+                if admin_site in (None, key[0]) and model in (None, key[1]):
+                    del self.entries[key]
+                    self.invalidations += 1
+
+    def info(self):
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, self.invalidations, len(self.entries))
+
+    def clear(self):
+        """Empties the cache and resets its statistics"""
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = self.invalidations = 0
+
+
+def build_model_metadata(admin_site, model):
+    admin_obj = admin_site._registry[model]
+    opts = model._meta
+    fields = [field for field in opts.get_fields()
+              if field.concrete and not field.auto_created]
+    unique_fields = frozenset(field.name for field in fields if field.unique)
+    exclude_fields = frozenset(getattr(admin_obj, 'massadmin_exclude', ()))
+    numeric_fields, text_fields = get_expression_fields(model)
+    return ModelMetadata(
+        unique_fields=unique_fields,
+        exclude_fields=exclude_fields,
+        m2m_fields=frozenset(field.name for field in opts.many_to_many),
+        file_fields=frozenset(field.name for field in fields if isinstance(field, FileField)),
+        editable_fields=frozenset(
+            field.name for field in fields
+            if field.editable
+            and field.name not in unique_fields
+            and field.name not in exclude_fields),
+        numeric_fields=frozenset(numeric_fields),
+        text_fields=frozenset(text_fields),
+    )
+
+
+def build_mass_admin(admin_site, model, mass_admin_class):
+    return mass_admin_class.for_model(model, admin_site)
+
+
+metadata_cache = AdminCache(build_model_metadata)
+mass_admin_cache = AdminCache(build_mass_admin)
+
+
+def get_model_metadata(admin_site, model):
+    """Metadata of `model` as registered on `admin_site`"""
+    return metadata_cache.get(admin_site, model)
+
+
+def get_mass_admin(mass_admin_class, admin_site, model):
+    """
+    `mass_admin_class` instance for `model`, shared between requests like
+    the ModelAdmin it wraps
+    """
+    return mass_admin_cache.get(admin_site, model, mass_admin_class)
+
+
+def invalidate(admin_site=None, model=None):
+    metadata_cache.invalidate(admin_site, model)
+    mass_admin_cache.invalidate(admin_site, model)
+
+
+def cache_info():
+    return {'metadata': metadata_cache.info(), 'mass_admin': mass_admin_cache.info()}
+
+
+def cache_clear():
+    metadata_cache.clear()
+    mass_admin_cache.clear()
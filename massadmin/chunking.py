@@ -0,0 +1,65 @@
+"""
+Sizes of the UPDATE batches of the bulk engine.
+
+``MASSEDIT['UPDATE_CHUNK_SIZE']`` sets the number of pks per UPDATE. With
+``MASSEDIT['ADAPTIVE_CHUNK_SIZE']`` the size starts there, never exceeds what
+the database backend accepts in one query, and is adjusted after every batch
+so that a batch (and the row locks it holds) lasts about
+``MASSEDIT['UPDATE_TARGET_SECONDS']``.
+"""
+from . import settings
+
+# Bound parameters accepted in one query by backends without a documented
+# limit (PostgreSQL's protocol allows 65535)
+DEFAULT_MAX_QUERY_PARAMS = 65535
+MIN_CHUNK_SIZE = 10
+
+
+def get_max_chunk_size(connection, values_count=0):
+    """Largest number of pks an UPDATE setting `values_count` values can filter on"""
+    max_params = connection.features.max_query_params or DEFAULT_MAX_QUERY_PARAMS
+    return max(1, max_params - values_count)
+
+
+class ChunkSizer:
+    """Fixed chunk size, callable so iter_pk_chunks asks it before each chunk"""
+
+    def __init__(self, size):
+        self.size = size
+
+    def __call__(self):
+        return self.size
+
+    def record(self, size, seconds):
+        """Called after each batch with its size and duration"""
+
+
+class AdaptiveChunkSizer(ChunkSizer):
+    """Grows or shrinks the chunk size to keep batches close to `target_seconds`"""
+
+    def __init__(self, size, target_seconds, minimum=MIN_CHUNK_SIZE, maximum=None):
+        self.minimum = min(minimum, size)
+        self.maximum = maximum or size
+        self.target_seconds = target_seconds
+        super().__init__(self.clamp(size))
+
+    def clamp(self, size):
+        return max(self.minimum, min(self.maximum, int(size)))
+
+    def record(self, size, seconds):
+        if size < self.size:
+            # last, partial chunk, says nothing about the chunk size
+            return
+        if seconds > self.target_seconds:
+            self.size = self.clamp(size * self.target_seconds / seconds)
+        elif seconds < self.target_seconds / 2:
+            self.size = self.clamp(size * 2)
+
+
+def get_update_chunk_sizer(connection, values_count=0):
+    """Chunk sizer configured in settings, bounded by the backend limits"""
+    maximum = get_max_chunk_size(connection, values_count)
+    size = min(settings.UPDATE_CHUNK_SIZE, maximum)
+    if settings.ADAPTIVE_CHUNK_SIZE:
+        return AdaptiveChunkSizer(size, settings.UPDATE_TARGET_SECONDS, maximum=maximum)
+    return ChunkSizer(size)
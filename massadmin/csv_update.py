@@ -0,0 +1,247 @@
+"""
+Mass edits giving each object its own values, read from an uploaded file.
+
+The file posted as ``_mass_csv`` is a CSV file whose first row names the
+columns: ``pk`` (or the name of the primary key) followed by the fields to
+change. Tab separated files (named ``*.tsv`` or with tabs in their first row)
+are read too. Empty cells leave the field unchanged.
+
+The file is streamed. Each distinct value of a column is validated once by
+the form field of the admin's ``ModelForm`` (the results of the last
+``VALUE_CACHE_SIZE`` values are kept), and rows are written by chunks with
+one ``UPDATE ... SET field = CASE WHEN pk = ... END`` query per chunk, so
+memory use doesn't grow with the size of the file. Rows of objects that are
+not selected are skipped. Like the bulk engine, objects are not saved one by
+one: ``mass_pre_update``/``mass_post_update`` are sent for every chunk. The
+objects of each written chunk are logged to the admin history, if given.
+Files are refused when the admin form validates the columns with
+``clean()``/``clean_<field>()``, or when the model or the admin saves
+objects with their own logic (see ``engines.get_job_obstacles``).
+"""
+import codecs
+import csv
+import itertools
+from functools import lru_cache
+
+from django.core.exceptions import ValidationError
+from django.db import connections, router
+from django.db.models import Case, F, Model, Value, When
+from django.db.models.query import QuerySet
+from django.utils.translation import gettext as _
+
+from . import instrumentation
+from . import settings
+from .chunking import get_max_chunk_size
+from .engines import get_job_obstacles
+from .signals import has_mass_update_receivers, mass_post_update, mass_pre_update
+
+CSV_FILE = '_mass_csv'
+
+# Distinct values of a column whose validation result is kept
+VALUE_CACHE_SIZE = 10000
+# Errors reported for a file, reading stops after them
+MAX_REPORTED_ERRORS = 10
+
+
+class CsvUpdateError(Exception):
+    """The file can't be applied, nothing was changed"""
+
+    def __init__(self, messages):
+        super(CsvUpdateError, self).__init__(messages)
+        self.messages = messages
+
+    def __str__(self):
+        return ' '.join(str(message) for message in self.messages)
+
+
+def decode_lines(uploaded_file):
+    try:
+        for line in codecs.iterdecode(uploaded_file, 'utf-8-sig'):
+            yield line
+    except UnicodeDecodeError:
+        raise CsvUpdateError([_('The file must be encoded in UTF-8.')])
+
+
+def iter_rows(reader):
+    """Rows of a csv.reader, a malformed file raising CsvUpdateError"""
+    try:
+        for row in reader:
+            yield row
+    except csv.Error as e:
+        raise CsvUpdateError([_('Line %(line)s: %(error)s') % {
+            'line': reader.line_num, 'error': e}])
+
+
+def read_rows(uploaded_file):
+    """Streams the rows of an uploaded CSV or TSV file as lists of strings"""
+    lines = decode_lines(uploaded_file)
+    first_line = next(lines, '')
+    delimiter = ','
+    if (uploaded_file.name or '').lower().endswith('.tsv') or '\t' in first_line:
+        delimiter = '\t'
+    return csv.reader(itertools.chain([first_line], lines), delimiter=delimiter)
+
+
+class Column:
+    """A field set from the file, validated by its form field"""
+
+    def __init__(self, model_field, form_field):
+        self.name = model_field.name
+        self.attname = model_field.attname
+        self.model_field = model_field
+        self.form_field = form_field
+        self.clean = lru_cache(maxsize=VALUE_CACHE_SIZE)(self._clean)
+
+    def _clean(self, raw_value):
+        """(value, None) or (None, error messages)"""
+        try:
+            value = self.form_field.clean(raw_value)
+            if isinstance(value, Model):
+                value = value.pk
+            if value is not None:
+                self.model_field.run_validators(value)
+        except ValidationError as e:
+            return None, e.messages
+        return value, None
+
+
+class CsvUpdate:
+    """Applies an uploaded file to the selected objects of `queryset`"""
+
+    def __init__(self, queryset, object_ids, ModelForm, fields, history=None, admin_obj=None):
+        self.queryset = queryset
+        self.ModelForm = ModelForm
+        # ModelAdmin whose per-object validation and saving is checked for
+        self.admin_obj = admin_obj
+        # MassChangeLog, its change message is set from the columns of the file
+        self.history = history
+        self.model = queryset.model
+        self.object_ids = object_ids
+        self.form_fields = ModelForm.base_fields
+        self.fields = fields
+        self.using = router.db_for_write(self.model)
+
+    def get_columns(self, header):
+        opts = self.model._meta
+        if not header or header[0].strip() not in ('pk', opts.pk.name):
+            raise CsvUpdateError([_('The first column of the file must be "pk".')])
+        columns = []
+        for name in header[1:]:
+            name = name.strip()
+            if name not in self.fields or name not in self.form_fields:
+                raise CsvUpdateError([
+                    _('The column "%(name)s" is not a field that can be changed.') % {
+                        'name': name}])
+            columns.append(Column(opts.get_field(name), self.form_fields[name]))
+        return columns
+
+    def get_selected(self):
+        """Filter keeping the selected objects when writing, and a pk set for lists"""
+        if isinstance(self.object_ids, QuerySet):
+            return {'pk__in': self.object_ids}, None
+        to_python = self.model._meta.pk.to_python
+        return {}, {to_python(pk) for pk in self.object_ids}
+
+    def get_chunk_size(self, columns):
+        # every row binds its pk and value once per column
+        maximum = get_max_chunk_size(connections[self.using]) // (2 * len(columns) + 1)
+        return max(1, min(settings.UPDATE_CHUNK_SIZE, maximum))
+
+    def write(self, columns, rows, selected_filter):
+        """Updates the objects of the chunk `rows` ({pk: {attname: value}})"""
+        values = {}
+        for column in columns:
+            whens = [
+                When(pk=pk, then=Value(row[column.attname], output_field=column.model_field))
+                for pk, row in rows.items() if column.attname in row]
+            if whens:
+                values[column.attname] = Case(
+                    *whens, default=F(column.attname), output_field=column.model_field)
+        if not values:
+            return 0
+        pks = list(rows)
+        send_signals = has_mass_update_receivers(self.model)
+        with instrumentation.span('write', self.model) as write_span:
+            if send_signals:
+                mass_pre_update.send(
+                    sender=self.model, pks=pks, fields=list(values), values=values,
+                    using=self.using)
+            written = self.queryset.filter(pk__in=pks, **selected_filter)
+            updated = written.update(**values)
+            if send_signals:
+                mass_post_update.send(
+                    sender=self.model, pks=pks, fields=list(values), values=values,
+                    using=self.using)
+            write_span.rows = updated
+        if self.history is not None and updated:
+            with instrumentation.span('log', self.model, rows=updated):
+                self.history.add_queryset(written.order_by('pk'))
+        return updated
+
+    def run(self, uploaded_file):
+        """
+        Applies the file and returns (updated objects, rows read). Raises
+        CsvUpdateError listing the first errors, the caller rolls back what
+        was written then.
+        """
+        reader = read_rows(uploaded_file)
+        rows_iterator = iter_rows(reader)
+        columns = self.get_columns(next(rows_iterator, None))
+        if not columns:
+            raise CsvUpdateError([_('The file has no column to change.')])
+        if self.admin_obj is not None:
+            # values are only checked by their form field, not by the whole form
+            reasons = get_job_obstacles(
+                self.admin_obj, self.model, self.ModelForm, [column.name for column in columns])
+            if reasons:
+                raise CsvUpdateError([
+                    _('These columns are validated or saved object by object and can\'t be '
+                      'read from a file: %(reasons)s.') % {'reasons': '; '.join(reasons)}])
+        if self.history is not None:
+            self.history.change_message = [{'changed': {'fields': [
+                str(column.form_field.label or column.name) for column in columns]}}]
+        pk_field = self.model._meta.pk
+        selected_filter, selected_pks = self.get_selected()
+        chunk_size = self.get_chunk_size(columns)
+
+        errors = []
+        updated = rows_count = 0
+        rows = {}
+        for row in rows_iterator:
+            if not any(cell.strip() for cell in row):
+                continue
+            rows_count += 1
+            line = reader.line_num
+            try:
+                pk = pk_field.to_python(row[0].strip())
+            except ValidationError as e:
+                errors.append(_('Line %(line)s: %(error)s') % {
+                    'line': line, 'error': ' '.join(e.messages)})
+                continue
+            values = {}
+            for column, raw_value in zip(columns, row[1:]):
+                if raw_value == '':
+                    continue
+                value, error = column.clean(raw_value)
+                if error:
+                    errors.append(_('Line %(line)s, column "%(name)s": %(error)s') % {
+                        'line': line, 'name': column.name, 'error': ' '.join(error)})
+                else:
+                    values[column.attname] = value
+            if len(errors) >= MAX_REPORTED_ERRORS:
+                break
+            if errors or selected_pks is not None and pk not in selected_pks:
+                # nothing is written once an error was found
+                continue
+            rows[pk] = values
+            if len(rows) >= chunk_size:
+                updated += self.write(columns, rows, selected_filter)
+                rows = {}
+
+        if errors:
+            raise CsvUpdateError(errors[:MAX_REPORTED_ERRORS])
+        if rows:
+            updated += self.write(columns, rows, selected_filter)
+        if self.history is not None:
+            self.history.close()
+        return updated, rows_count
@@ -0,0 +1,101 @@
+"""
+Choice of the engine applying a mass edit.
+
+The bulk engine (``MassAdminImproved``) writes the whole selection with a few
+``UPDATE`` queries, but skips everything that runs per object: ``save()``
+overrides, ``pre_save``/``post_save`` receivers, ``auto_now`` fields, admin
+``save_model`` overrides and validation depending on the edited instance. The selector only
+picks it when none of these would be skipped.
+"""
+import logging
+
+from django import forms
+from django.contrib import admin
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Model
+from django.db.models.signals import m2m_changed, post_save, pre_save
+
+from .m2m import supports_bulk_m2m
+
+ENGINE_CLASSIC = 'classic'
+ENGINE_BULK = 'bulk'
+ENGINES = (ENGINE_CLASSIC, ENGINE_BULK)
+
+logger = logging.getLogger(__name__)
+
+ADMIN_SAVE_METHODS = ('save_model', 'save_formset', 'save_related')
+
+
+def get_job_obstacles(admin_obj, model, form_class, fields):
+    """
+    Reasons why a per-object job would not be equivalent to the admin saving
+    every object: jobs validate the form once, against the first object,
+    then call save() on every object, skipping the admin's save methods.
+    """
+    reasons = []
+    if model.clean is not Model.clean:
+        reasons.append('%s overrides clean()' % model.__name__)
+    for name in ADMIN_SAVE_METHODS:
+        if getattr(type(admin_obj), name) is not getattr(admin.ModelAdmin, name):
+            reasons.append('%s overrides %s()' % (type(admin_obj).__name__, name))
+    if form_class.clean is not forms.ModelForm.clean:
+        reasons.append('%s overrides clean()' % form_class.__name__)
+    for name in fields:
+        if hasattr(form_class, 'clean_%s' % name):
+            reasons.append('%s defines clean_%s()' % (form_class.__name__, name))
+    return reasons
+
+
+def get_bulk_obstacles(admin_obj, model, form_class, fields):
+    """
+    Reasons why editing `fields` with a bulk update would not be equivalent
+    to saving every object. An empty list means the bulk engine is safe.
+    """
+    reasons = []
+    if model.save is not Model.save:
+        reasons.append('%s overrides save()' % model.__name__)
+    reasons.extend(get_job_obstacles(admin_obj, model, form_class, fields))
+    for field in model._meta.concrete_fields:
+        if getattr(field, 'auto_now', False):
+            # only set by pre_save(), which update() doesn't call
+            reasons.append('%s has auto_now' % field.name)
+    if not getattr(admin_obj, 'massadmin_bulk_signals', False):
+        # otherwise the receivers handle mass_pre_update/mass_post_update too
+        for signal_name, signal in (('pre_save', pre_save), ('post_save', post_save)):
+            if signal.has_listeners(model):
+                reasons.append('%s receivers are connected' % signal_name)
+
+    for name in fields:
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            reasons.append('%s is not a model field' % name)
+            continue
+        if field.many_to_many and not supports_bulk_m2m(field):
+            reasons.append('%s has a custom through model' % name)
+        if field.many_to_many and m2m_changed.has_listeners(field.remote_field.through):
+            reasons.append('m2m_changed receivers are connected to %s' % name)
+    return reasons
+
+
+def select_engine(admin_obj, model, form_class, fields):
+    """
+    Returns the fastest correct engine for editing `fields` and the reasons
+    the bulk engine was not chosen.
+
+    ``ModelAdmin.massadmin_engine`` forces one engine.
+    """
+    forced = getattr(admin_obj, 'massadmin_engine', None)
+    if forced in ENGINES:
+        reasons = ['forced by %s.massadmin_engine' % type(admin_obj).__name__]
+        engine = forced
+    else:
+        reasons = get_bulk_obstacles(admin_obj, model, form_class, fields)
+        engine = ENGINE_CLASSIC if reasons else ENGINE_BULK
+    logger.info(
+        'Mass edit of %s (%s) uses the %s engine%s',
+        model._meta.label,
+        ', '.join(fields),
+        engine,
+        ': %s' % '; '.join(reasons) if reasons else '')
+    return engine, reasons
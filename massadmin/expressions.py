@@ -0,0 +1,87 @@
+"""
+Mass edits computed by the database from the current value of each object.
+
+The operator of a field is posted as ``_mass_op_<field>``; the posted field
+value is its operand. ``replace`` also needs the text to look for, posted as
+``_mass_op_find_<field>``. Operators other than ``set`` are compiled into
+``F()``/``Concat``/``Replace`` expressions, so a single ``UPDATE`` edits every
+object without loading it.
+"""
+from django.core.exceptions import ValidationError
+from django.db.models import (
+    CharField, DecimalField, F, FloatField, IntegerField, TextField, Value,
+)
+from django.db.models.functions import Concat, Replace
+from django.utils.translation import gettext as _
+
+OP_SET = 'set'
+OP_ADD = 'add'
+OP_MULTIPLY = 'multiply'
+OP_APPEND = 'append'
+OP_PREPEND = 'prepend'
+OP_REPLACE = 'replace'
+
+NUMERIC_OPS = (OP_ADD, OP_MULTIPLY)
+TEXT_OPS = (OP_APPEND, OP_PREPEND, OP_REPLACE)
+
+
+def is_numeric_field(field):
+    return (isinstance(field, (IntegerField, FloatField, DecimalField))
+            and not field.primary_key and not field.choices)
+
+
+def is_text_field(field):
+    return isinstance(field, (CharField, TextField)) and not field.choices
+
+
+def get_expression_fields(model):
+    """Names of the (numeric, text) fields of `model` accepting operators"""
+    fields = [field for field in model._meta.concrete_fields if field.editable]
+    return ([field.name for field in fields if is_numeric_field(field)],
+            [field.name for field in fields if is_text_field(field)])
+
+
+def get_mass_ops(request, model):
+    """{field name: operator} of the fields edited with an operator other than set"""
+    ops = {}
+    for field in model._meta.concrete_fields:
+        op = request.POST.get('_mass_op_%s' % field.name, OP_SET)
+        if op in NUMERIC_OPS and is_numeric_field(field) or op in TEXT_OPS and is_text_field(field):
+            ops[field.name] = op
+    return ops
+
+
+def get_expression(field, op, value, find=''):
+    """Expression computing the new value of `field` from its current one"""
+    if op == OP_ADD:
+        return F(field.name) + Value(value, output_field=field)
+    if op == OP_MULTIPLY:
+        return F(field.name) * Value(value, output_field=field)
+    if op == OP_APPEND:
+        return Concat(F(field.name), Value(value), output_field=field)
+    if op == OP_PREPEND:
+        return Concat(Value(value), F(field.name), output_field=field)
+    if op == OP_REPLACE:
+        return Replace(F(field.name), Value(find), Value(value), output_field=field)
+    raise ValueError('Unknown operator %r' % op)
+
+
+def apply_mass_ops(request, model, values):
+    """Replaces the values of the fields edited with an operator by their expression"""
+    for name, op in get_mass_ops(request, model).items():
+        if name in values:
+            value = values[name]
+            field = model._meta.get_field(name)
+            if op in TEXT_OPS:
+                # form fields strip whitespace, which matters here
+                value = request.POST.get(name, value)
+            if value is None:
+                # a blank nullable field, the operator would write NULL
+                raise ValidationError(_('"%(name)s" needs a value to be computed from the '
+                                        'current one.') % {'name': field.verbose_name})
+            values[name] = get_expression(
+                field,
+                op,
+                value,
+                request.POST.get('_mass_op_find_%s' % name, ''))
+    return values
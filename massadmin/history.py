@@ -0,0 +1,89 @@
+"""
+Admin log ("history") entries of mass edits.
+
+Entries are buffered and written with ``bulk_create`` instead of one INSERT
+per object. With ``MASSEDIT['LOG_MODE'] = 'summary'`` a single entry is
+written for the whole edit, its object id being the encoded pk set.
+"""
+import json
+
+from django.contrib.admin.models import CHANGE, LogEntry
+from django.contrib.contenttypes.models import ContentType
+
+from . import selection
+from . import settings
+
+LOG_MODE_BULK = 'bulk'
+LOG_MODE_SUMMARY = 'summary'
+
+
+def get_fields_change_message(form):
+    """Change message listing the fields of a mass change form"""
+    labels = [str(field.label or name) for name, field in form.fields.items()]
+    return [{'changed': {'fields': labels}}] if labels else []
+
+
+class MassChangeLog:
+    """Collects the objects changed by a mass edit and logs them in batches"""
+
+    def __init__(self, user_id, model, change_message=None, mode=None, batch_size=None):
+        self.user_id = user_id
+        self.model = model
+        self.change_message = change_message
+        self.mode = mode or settings.LOG_MODE
+        self.batch_size = batch_size or settings.CHUNK_SIZE
+        self.content_type_id = ContentType.objects.get_for_model(model).pk
+        self.entries = []
+        self.pks = []
+
+    def add(self, obj, change_message=None):
+        """Logs `obj`, with its own message or the one shared by the edit"""
+        if self.mode == LOG_MODE_SUMMARY:
+            self.pks.append(obj.pk)
+            return
+        message = change_message if change_message is not None else self.change_message
+        self.entries.append(LogEntry(
+            user_id=self.user_id,
+            content_type_id=self.content_type_id,
+            object_id=str(obj.pk),
+            object_repr=str(obj)[:200],
+            action_flag=CHANGE,
+            change_message=json.dumps(message or []),
+        ))
+        if len(self.entries) >= self.batch_size:
+            self.flush()
+
+    def add_queryset(self, queryset):
+        """Logs the objects of `queryset`, only their pks are loaded in summary mode"""
+        if self.mode == LOG_MODE_SUMMARY:
+            self.pks.extend(queryset.values_list('pk', flat=True))
+            return
+        for obj in queryset:
+            self.add(obj)
+
+    def flush(self):
+        if self.entries:
+            LogEntry.objects.bulk_create(self.entries)
+            self.entries = []
+
+    def close(self):
+        """Writes what is still buffered, or the summary entry"""
+        if self.mode == LOG_MODE_SUMMARY and self.pks:
+            opts = self.model._meta
+            name = opts.verbose_name if len(self.pks) == 1 else opts.verbose_name_plural
+            fields = []
+            for message in self.change_message or []:
+                fields.extend(message.get('changed', {}).get('fields', []))
+            object_repr = '%s %s' % (len(self.pks), name)
+            if fields:
+                object_repr += ': %s' % ', '.join(fields)
+            LogEntry.objects.create(
+                user_id=self.user_id,
+                content_type_id=self.content_type_id,
+                object_id=selection.encode_pk_list(self.pks),
+                object_repr=object_repr[:200],
+                action_flag=CHANGE,
+                change_message=json.dumps(self.change_message or []),
+            )
+            self.pks = []
+        self.flush()
@@ -0,0 +1,114 @@
+"""
+Set based edits of inline (child) objects.
+
+An inline whose prefix is posted in ``_bulk_inline`` is not validated and
+saved once per selected object. Instead, its formset is validated once and:
+
+* every new row of the formset is added to every selected object, with
+  chunked ``bulk_create``;
+* the child fields listed in ``_bulk_inline_update_<prefix>`` are set on all
+  the existing children of the selected objects with one filtered ``update()``
+  per chunk, their values being posted as ``<prefix>-__all__-<field>``.
+
+Children are written without calling their ``save()`` or sending signals,
+and their many-to-many fields are ignored. The permissions of the inline are
+checked once: ``has_add_permission`` for new rows and
+``has_change_permission`` for updated children.
+"""
+from django.core.exceptions import PermissionDenied
+from django.utils.encoding import force_str
+from django.utils.translation import gettext as _
+
+from . import settings
+
+BULK_INLINE = '_bulk_inline'
+
+
+def get_bulk_inline_prefixes(request):
+    return request.POST.getlist(BULK_INLINE)
+
+
+class BulkInline:
+    """Changes posted for the inline `prefix`, applied to chunks of parents"""
+
+    def __init__(self, FormSet, prefix, request, instance, inline=None, chunk_size=None):
+        self.prefix = prefix
+        self.inline = inline
+        self.formset = FormSet(request.POST, request.FILES, instance=instance, prefix=prefix)
+        self.model = self.formset.model
+        self.fk = self.formset.fk
+        self.chunk_size = chunk_size or settings.CHUNK_SIZE
+        self.parent_ids = []
+
+        update_fields = request.POST.getlist('_bulk_inline_update_%s' % prefix)
+        self.update_form = None
+        if update_fields:
+            self.update_form = FormSet.form(
+                request.POST, request.FILES, prefix='%s-__all__' % prefix)
+            for field_name in list(self.update_form.fields):
+                if field_name not in update_fields:
+                    del self.update_form.fields[field_name]
+
+    def check_permissions(self, request, obj):
+        """Raises PermissionDenied if the inline doesn't allow the posted changes"""
+        if self.inline is None:
+            return
+        # the forms of the admin's formset ignore the changes the user may not make,
+        # so changed_data is looked at instead of has_changed()
+        name = force_str(self.model._meta.verbose_name_plural)
+        if any(form.changed_data for form in self.formset.extra_forms) and not (
+                self.inline.has_add_permission(request, obj)):
+            raise PermissionDenied(_('You are not allowed to add %(name)s.') % {'name': name})
+        if self.update_form is not None and not self.inline.has_change_permission(request, obj):
+            raise PermissionDenied(
+                _('You are not allowed to change %(name)s.') % {'name': name})
+
+    def is_valid(self):
+        formset_valid = self.formset.is_valid()
+        return formset_valid and (self.update_form is None or self.update_form.is_valid())
+
+    @property
+    def errors(self):
+        """Error lists of the formset and of the update form"""
+        errors = [self.formset.non_form_errors()]
+        for form_errors in self.formset.errors:
+            errors.extend(form_errors.values())
+        if self.update_form is not None:
+            errors.extend(self.update_form.errors.values())
+        return [error_list for error_list in errors if error_list]
+
+    def get_new_rows(self):
+        """Values of the concrete fields of every new child, keyed by attname"""
+        rows = []
+        for form in self.formset.extra_forms:
+            if not form.has_changed() or self.formset._should_delete_form(form):
+                continue
+            rows.append({
+                field.attname: getattr(form.instance, field.attname)
+                for field in self.model._meta.concrete_fields
+                if not field.primary_key and field.name != self.fk.name})
+        return rows
+
+    def apply(self, parent_ids):
+        """Adds the new rows to, and updates the children of, `parent_ids`"""
+        parent_ids = list(parent_ids)
+        rows = self.get_new_rows()
+        if rows:
+            self.model._default_manager.bulk_create(
+                [self.model(**dict(row, **{self.fk.attname: parent_id}))
+                 for parent_id in parent_ids
+                 for row in rows],
+                batch_size=self.chunk_size)
+        if self.update_form is not None and self.update_form.cleaned_data:
+            self.model._default_manager.filter(
+                **{self.fk.attname + '__in': parent_ids}).update(**self.update_form.cleaned_data)
+
+    def add(self, parent_id):
+        self.parent_ids.append(parent_id)
+        if len(self.parent_ids) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.parent_ids:
+            self.apply(self.parent_ids)
+        self.parent_ids = []
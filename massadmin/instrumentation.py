@@ -0,0 +1,132 @@
+"""
+Timing of the phases of mass edits.
+
+Mass change views measure their phases as spans: ``decode`` (parsing and
+counting the selection), ``permission``, ``validation``, ``write`` (one span
+per chunk of written objects), ``log`` (admin history) and ``render``. Every
+finished span is sent as a ``SpanEvent`` to the subscribed callables::
+
+    from massadmin import instrumentation
+
+    def record(event):
+        statsd.timing('massadmin.%s' % event.name, event.seconds * 1000)
+
+    instrumentation.subscribe(record)
+
+``log_event``, subscribed by default, logs the events at DEBUG level to the
+``massadmin.instrumentation`` logger; ``unsubscribe(log_event)`` turns it
+off. Nothing is measured while no subscriber would receive the events.
+Queries are counted on the database the edited model is written to, during
+the mass change view.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.db import connections, router
+
+logger = logging.getLogger(__name__)
+
+SpanEvent = namedtuple('SpanEvent', ['name', 'model', 'seconds', 'rows', 'queries', 'data'])
+
+_local = threading.local()
+
+
+def log_event(event):
+    logger.debug(
+        'Mass edit of %s: %s took %.3fs, %s rows, %s queries%s',
+        event.model,
+        event.name,
+        event.seconds,
+        event.rows,
+        event.queries,
+        ''.join(' %s=%s' % item for item in sorted(event.data.items())))
+
+
+subscribers = [log_event]
+
+
+def subscribe(callback):
+    """Sends every SpanEvent to `callback`"""
+    if callback not in subscribers:
+        subscribers.append(callback)
+
+
+def unsubscribe(callback):
+    if callback in subscribers:
+        subscribers.remove(callback)
+
+
+def is_enabled():
+    return any(callback is not log_event or logger.isEnabledFor(logging.DEBUG)
+               for callback in subscribers)
+
+
+def get_query_count():
+    return getattr(_local, 'queries', 0)
+
+
+def _count_query(execute, sql, params, many, context):
+    _local.queries = get_query_count() + 1
+    return execute(sql, params, many, context)
+
+
+@contextmanager
+def track_queries(model):
+    """Counts the queries sent to the database `model` is written to"""
+    connection = connections[router.db_for_write(model)]
+    if not is_enabled() or _count_query in connection.execute_wrappers:
+        yield
+        return
+    with connection.execute_wrapper(_count_query):
+        yield
+
+
+class Span:
+    """
+    A phase of a mass edit. It may be measured in several parts, between
+    start() and stop() calls, before being sent with emit().
+    """
+
+    def __init__(self, name, model, rows=0, **data):
+        self.name = name
+        self.model = model
+        self.rows = rows
+        self.data = data
+        self.enabled = is_enabled()
+        self.seconds = 0.0
+        self.queries = 0
+        self.started = None
+
+    def start(self):
+        if self.enabled:
+            self.started = (time.perf_counter(), get_query_count())
+
+    def stop(self):
+        if self.started is not None:
+            started, queries = self.started
+            self.seconds += time.perf_counter() - started
+            self.queries += get_query_count() - queries
+            self.started = None
+
+    def emit(self):
+        """Sends the measured parts to the subscribers and starts over"""
+        if self.enabled:
+            event = SpanEvent(self.name, self.model._meta.label, self.seconds, self.rows,
+                              self.queries, self.data)
+            for callback in list(subscribers):
+                callback(event)
+        self.seconds = 0.0
+        self.queries = self.rows = 0
+
+
+@contextmanager
+def span(name, model, rows=0, **data):
+    """Measures the block as one Span, sent when the block succeeds"""
+    measured = Span(name, model, rows, **data)
+    measured.start()
+    yield measured
+    measured.stop()
+    measured.emit()
@@ -0,0 +1,251 @@
+"""
+Background mass edits.
+
+The admin view validates the mass change form once, stores the cleaned values
+in a ``MassEditJob`` row and returns immediately. The ``massadmin_worker``
+management command picks pending jobs from that table (no external broker is
+needed) and applies them in chunks, recording progress as it goes.
+"""
+import json
+from array import array
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.query import QuerySet
+from django.utils import timezone
+
+from . import selection
+from . import settings
+from .history import MassChangeLog
+from .m2m import M2M_REPLACE, bulk_set_m2m
+from .models import MassEditJob
+from .signals import has_mass_update_receivers, mass_post_update, mass_pre_update
+
+# Only the first errors are kept on the job, the counter keeps the total
+MAX_RECORDED_ERRORS = 100
+
+
+def serialize_values(model, cleaned_data):
+    """Converts cleaned form values into JSON, relations are stored as pks"""
+    values = {}
+    for name, value in cleaned_data.items():
+        field = model._meta.get_field(name)
+        if field.many_to_many:
+            values[name] = [related.pk for related in value]
+        elif field.is_relation:
+            values[name] = value.pk if value is not None else None
+        else:
+            values[name] = value
+    return json.dumps(values, cls=DjangoJSONEncoder)
+
+
+def deserialize_values(model, raw_values):
+    """
+    Reverses serialize_values.
+
+    Returns a tuple of (concrete values keyed by attname, m2m pk lists keyed by name)
+    """
+    values, m2m_values = {}, {}
+    for name, value in json.loads(raw_values).items():
+        field = model._meta.get_field(name)
+        if field.many_to_many:
+            m2m_values[name] = value
+        elif field.is_relation:
+            values[field.attname] = value
+        else:
+            values[name] = field.to_python(value)
+    return values, m2m_values
+
+
+def iter_found_pks(queryset, object_ids):
+    """
+    Yields the pks of the selected objects found in `queryset`, in ascending
+    order, loading them a chunk at a time.
+    """
+    if isinstance(object_ids, QuerySet):
+        found = queryset.filter(pk__in=object_ids).values_list('pk', flat=True)
+        for chunk in selection.iter_pk_chunks(found, settings.CHUNK_SIZE):
+            yield from chunk
+        return
+    if not isinstance(object_ids, array):
+        # decoded pk sets are already sorted
+        to_python = queryset.model._meta.pk.to_python
+        object_ids = sorted({to_python(pk) for pk in object_ids})
+    for pk_filter, size in selection.iter_pk_filters(object_ids, settings.CHUNK_SIZE):
+        yield from queryset.filter(pk_filter).order_by('pk').values_list('pk', flat=True)
+
+
+def enqueue_job(model, object_ids, cleaned_data, user=None, engine=MassEditJob.ENGINE_CLASSIC,
+                queryset=None, m2m_modes=None):
+    """
+    Stores a validated mass edit to be applied by the worker.
+
+    Only the selected objects found in `queryset` (all the objects of
+    `model` by default) are stored on the job, the worker doesn't see the
+    admin's queryset restrictions. `m2m_modes` maps many-to-many field
+    names to M2M_ADD or M2M_REPLACE (the default).
+    """
+    if queryset is None:
+        queryset = model._default_manager.all()
+    token, count = selection.encode_sorted_pks(iter_found_pks(queryset, object_ids))
+    return MassEditJob.objects.create(
+        app_label=model._meta.app_label,
+        model_name=model._meta.model_name,
+        engine=engine,
+        object_ids=token,
+        values=serialize_values(model, cleaned_data),
+        m2m_modes=json.dumps(m2m_modes) if m2m_modes else '',
+        user=user,
+        total_count=count,
+    )
+
+
+def claim_next_job(stale_after=None):
+    """
+    Marks the oldest pending job as running and returns it.
+
+    With `stale_after` (seconds), running jobs that made no progress for
+    that long, their worker having died, are claimed again too; run_job
+    resumes them after their last saved chunk.
+
+    The claim is a conditional UPDATE so several workers can share the table
+    on any database backend without picking the same job twice.
+    """
+    while True:
+        now = timezone.now()
+        claimable = Q(status=MassEditJob.STATUS_PENDING)
+        if stale_after:
+            claimable |= Q(status=MassEditJob.STATUS_RUNNING,
+                           updated_at__lt=now - timedelta(seconds=stale_after))
+        job = MassEditJob.objects.filter(claimable).order_by('pk').first()
+        if job is None:
+            return None
+        started_at = job.started_at or now
+        claimed = MassEditJob.objects.filter(
+            pk=job.pk,
+            status=job.status,
+            updated_at=job.updated_at,
+        ).update(status=MassEditJob.STATUS_RUNNING, started_at=started_at, updated_at=now)
+        if claimed:
+            job.status = MassEditJob.STATUS_RUNNING
+            job.started_at = started_at
+            job.updated_at = now
+            return job
+
+
+def _record_error(job, errors, object_ids, error):
+    job.error_count += len(object_ids)
+    if len(errors) < MAX_RECORDED_ERRORS:
+        errors.append({'ids': [str(object_id) for object_id in object_ids], 'error': str(error)})
+
+
+def _apply_classic(queryset, values, m2m_values, m2m_modes, job, errors, history):
+    """Saves every object so that save() overrides and signals are honoured"""
+    for obj in queryset:
+        try:
+            with transaction.atomic():
+                for attname, value in values.items():
+                    setattr(obj, attname, value)
+                obj.save()
+                for name, pks in m2m_values.items():
+                    if m2m_modes.get(name, M2M_REPLACE) == M2M_REPLACE:
+                        getattr(obj, name).set(pks)
+                    else:
+                        getattr(obj, name).add(*pks)
+        except Exception as error:
+            _record_error(job, errors, [obj.pk], error)
+        else:
+            job.changed_count += 1
+            history.add(obj)
+    history.flush()
+
+
+def _apply_bulk(queryset, values, m2m_values, m2m_modes, job, errors, object_ids):
+    model = queryset.model
+    send_signals = has_mass_update_receivers(model)
+    signal_values = dict(values, **m2m_values)
+    try:
+        with transaction.atomic():
+            edited_ids = None
+            if send_signals or m2m_values:
+                edited_ids = list(queryset.values_list('pk', flat=True))
+                if not edited_ids:
+                    return
+                queryset = model._default_manager.filter(selection.get_pk_filter(edited_ids))
+            if send_signals:
+                mass_pre_update.send(
+                    sender=model, pks=edited_ids, fields=list(signal_values),
+                    values=signal_values, using=queryset.db)
+            if values:
+                job.changed_count += queryset.update(**values)
+            if m2m_values:
+                for name, pks in m2m_values.items():
+                    bulk_set_m2m(model, name, edited_ids, pks,
+                                 mode=m2m_modes.get(name, M2M_REPLACE))
+                if not values:
+                    job.changed_count += len(edited_ids)
+            if send_signals:
+                mass_post_update.send(
+                    sender=model, pks=edited_ids, fields=list(signal_values),
+                    values=signal_values, using=queryset.db)
+    except Exception as error:
+        _record_error(job, errors, object_ids, error)
+
+
+def run_job(job, chunk_size=None):
+    """Applies a claimed job chunk by chunk, saving progress after each chunk"""
+    chunk_size = chunk_size or settings.JOB_CHUNK_SIZE
+    errors = json.loads(job.errors) if job.errors else []
+    try:
+        model = apps.get_model(job.app_label, job.model_name)
+        values, m2m_values = deserialize_values(model, job.values)
+        m2m_modes = json.loads(job.m2m_modes) if job.m2m_modes else {}
+        history = MassChangeLog(job.user_id, model, change_message=[{'changed': {'fields': [
+            str(model._meta.get_field(name).verbose_name) for name in json.loads(job.values)]}}])
+        # written by enqueue_job, which counted its pks
+        object_ids = selection.parse_pk_list(
+            job.object_ids, max_size=job.total_count) if job.object_ids else []
+
+        for i in range(job.processed_count, len(object_ids), chunk_size):
+            chunk = object_ids[i: i + chunk_size]
+            queryset = model._default_manager.filter(selection.get_pk_filter(chunk))
+            if job.engine == MassEditJob.ENGINE_BULK:
+                _apply_bulk(queryset, values, m2m_values, m2m_modes, job, errors, chunk)
+            else:
+                _apply_classic(queryset, values, m2m_values, m2m_modes, job, errors, history)
+            job.processed_count = i + len(chunk)
+            job.errors = json.dumps(errors)
+            job.save(update_fields=[
+                'processed_count', 'changed_count', 'error_count', 'errors', 'updated_at'])
+
+        history.close()
+        job.status = MassEditJob.STATUS_DONE
+    except Exception as error:
+        errors.append({'ids': [], 'error': str(error)})
+        job.status = MassEditJob.STATUS_FAILED
+
+    job.errors = json.dumps(errors)
+    job.finished_at = timezone.now()
+    job.save()
+    return job
+
+
+def job_status(job):
+    """Progress report of a job, as returned to the admin polling it"""
+    return {
+        'id': job.pk,
+        'model': '%s.%s' % (job.app_label, job.model_name),
+        'engine': job.engine,
+        'status': job.status,
+        'total': job.total_count,
+        'processed': job.processed_count,
+        'changed': job.changed_count,
+        'error_count': job.error_count,
+        'errors': json.loads(job.errors) if job.errors else [],
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
@@ -0,0 +1,98 @@
+"""
+Set based many-to-many edits.
+
+Instead of clearing and adding related objects one object at a time, the rows
+of the through table are computed for a whole chunk of objects and written
+with one DELETE and one ``bulk_create(ignore_conflicts=True)`` per chunk.
+``m2m_changed`` signals are not sent.
+"""
+from . import selection
+from . import settings
+
+M2M_REPLACE = 'replace'
+M2M_ADD = 'add'
+M2M_MODES = (M2M_REPLACE, M2M_ADD)
+
+
+def get_m2m_mode(request, field_name):
+    """Mode chosen for `field_name` on the mass change form"""
+    mode = request.POST.get("_m2m_mode_%s" % field_name, M2M_REPLACE)
+    return mode if mode in M2M_MODES else M2M_REPLACE
+
+
+def supports_bulk_m2m(field):
+    """Only auto-created through tables can be written without the model's logic"""
+    return field.many_to_many and field.remote_field.through._meta.auto_created
+
+
+def bulk_set_m2m(model, field_name, object_ids, related_ids, mode=M2M_REPLACE, chunk_size=None):
+    """
+    Sets (or, in M2M_ADD mode, adds) `related_ids` as the related objects of
+    field `field_name` for every object in `object_ids`.
+
+    Custom through models are handled object by object through the manager.
+    """
+    field = model._meta.get_field(field_name)
+    through = field.remote_field.through
+    related_ids = list(related_ids)
+    chunk_size = chunk_size or settings.CHUNK_SIZE
+
+    if not through._meta.auto_created:
+        # custom through models may have their own logic, go through the manager
+        for chunk in selection.iter_pk_chunks(object_ids, chunk_size):
+            for obj in model._default_manager.filter(selection.get_pk_filter(chunk)):
+                manager = getattr(obj, field_name)
+                if mode == M2M_REPLACE:
+                    manager.set(related_ids)
+                else:
+                    manager.add(*related_ids)
+        return
+
+    source = through._meta.get_field(field.m2m_field_name()).attname
+    target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+    for chunk in selection.iter_pk_chunks(object_ids, chunk_size):
+        if mode == M2M_REPLACE:
+            through._default_manager.filter(**{source + '__in': chunk}).exclude(
+                **{target + '__in': related_ids}).delete()
+        if related_ids:
+            through._default_manager.bulk_create(
+                [through(**{source: object_id, target: related_id})
+                 for object_id in chunk
+                 for related_id in related_ids],
+                batch_size=chunk_size,
+                ignore_conflicts=True)
+
+
+class BulkM2MUpdater:
+    """
+    Collects the pks of edited objects and applies many-to-many values to
+    them a chunk at a time.
+    """
+
+    def __init__(self, model, values, modes=None, chunk_size=None):
+        self.model = model
+        # {field name: related pks}
+        self.values = values
+        self.modes = modes or {}
+        self.chunk_size = chunk_size or settings.CHUNK_SIZE
+        self.pks = []
+
+    def add(self, pk):
+        self.pks.append(pk)
+        if len(self.pks) >= self.chunk_size:
+            self.flush()
+
+    def apply(self, object_ids):
+        for field_name, related_ids in self.values.items():
+            bulk_set_m2m(
+                self.model,
+                field_name,
+                object_ids,
+                related_ids,
+                mode=self.modes.get(field_name, M2M_REPLACE),
+                chunk_size=self.chunk_size)
+
+    def flush(self):
+        if self.pks and self.values:
+            self.apply(self.pks)
+        self.pks = []
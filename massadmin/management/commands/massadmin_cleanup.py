@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from massadmin.stores import get_selection_store
+
+
+class Command(BaseCommand):
+    help = "Removes expired mass edit selections from the selection store"
+
+    def handle(self, *args, **options):
+        removed = get_selection_store().cleanup()
+        self.stdout.write("Removed %s mass edit selections" % removed)
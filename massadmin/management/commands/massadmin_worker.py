@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from massadmin.jobs import claim_next_job, run_job
+
+
+class Command(BaseCommand):
+    help = "Processes queued mass edit jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit as soon as the queue is empty instead of polling for new jobs.")
+        parser.add_argument(
+            '--sleep', type=float, default=5.0,
+            help="Seconds to wait between polls of an empty queue.")
+        parser.add_argument(
+            '--max-jobs', type=int, default=0,
+            help="Exit after processing this many jobs (0 means no limit).")
+        parser.add_argument(
+            '--chunk-size', type=int, default=None,
+            help="Number of objects edited per transaction.")
+        parser.add_argument(
+            '--requeue-after', type=float, default=3600.0,
+            help="Seconds without progress after which a running job is taken over, "
+                 "its worker being considered dead (0 never takes jobs over).")
+
+    def handle(self, *args, **options):
+        processed = 0
+        while not options['max_jobs'] or processed < options['max_jobs']:
+            job = claim_next_job(stale_after=options['requeue_after'])
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+
+            run_job(job, chunk_size=options['chunk_size'])
+            processed += 1
+            self.stdout.write("Job #%s %s: %s of %s objects changed, %s errors" % (
+                job.pk, job.status, job.changed_count, job.total_count, job.error_count))
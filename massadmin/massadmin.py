@@ -27,17 +27,21 @@ ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
 (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
-import hashlib
+import logging
 import types
 import sys
 
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.files.uploadedfile import UploadedFile
 try:
     from django.urls import reverse
 except ImportError:  # Django<2.0
     from django.core.urlresolvers import reverse
 from django.db import transaction
+from django.db.models import Q
+from django.db.models.query import QuerySet
+from django.db.models.signals import m2m_changed
 try:  # Django>=1.9
     from django.apps import apps
     get_model = apps.get_model
@@ -47,7 +51,8 @@ try:
     from django.contrib.admin.utils import unquote
 except ImportError:
     from django.contrib.admin.util import unquote
-from django.contrib.admin import helpers
+from django.contrib.admin import helpers, widgets
+from django.contrib.admin.options import IncorrectLookupParameters
 from django.utils.translation import gettext_lazy as _
 try:
     from django.utils.encoding import force_str
@@ -55,66 +60,84 @@ except ImportError:  # 1.4 compat
     from django.utils.encoding import force_unicode as force_str
 from django.utils.safestring import mark_safe
 from django.contrib.admin.views.decorators import staff_member_required
-from django.http import Http404, HttpResponseRedirect
+from django.http import Http404, HttpResponseRedirect, JsonResponse
 from django.utils.html import escape
 from django.shortcuts import render
 from django.forms.formsets import all_valid
 from django.contrib.admin.templatetags.admin_urls import add_preserved_filters
 
+from . import instrumentation
+from . import selection
 from . import settings
+from .cache import get_mass_admin, get_model_metadata
+from .csv_update import CSV_FILE, CsvUpdate, CsvUpdateError
+from .engines import ENGINE_CLASSIC, get_job_obstacles
+from .history import MassChangeLog, get_fields_change_message
+from .inlines import BulkInline, get_bulk_inline_prefixes
+from .m2m import M2M_ADD, BulkM2MUpdater, get_m2m_mode, supports_bulk_m2m
 
+# Objects listed when refusing part of a selection
+MAX_REPORTED_IDS = 10
 
-def mass_change_selected(modeladmin, request, queryset):
-    selected = queryset.values_list('pk', flat=True)
+logger = logging.getLogger(__name__)
 
-    redirect_url = get_mass_change_redirect_url(modeladmin.model._meta, selected, request.session)
-    redirect_url = add_preserved_filters(
-        {'preserved_filters': modeladmin.get_preserved_filters(request),
-         'opts': queryset.model._meta},
-        redirect_url)
 
+def mass_change_selected(modeladmin, request, queryset):
+    redirect_url = selection.get_action_redirect_url(
+        "massadmin_change_view", modeladmin, request, queryset)
     return HttpResponseRedirect(redirect_url)
 
 
 def get_mass_change_redirect_url(model_meta, pk_list, session):
-    object_ids = ",".join(str(s) for s in pk_list)
-    if len(object_ids) > settings.SESSION_BASED_URL_THRESHOLD:
-        hash_id = "session-%s" % hashlib.md5(object_ids.encode('utf-8')).hexdigest()
-        session[hash_id] = object_ids
-        session.save()
-        object_ids = hash_id
-    redirect_url = reverse(
-        "massadmin_change_view",
-        kwargs={"app_name": model_meta.app_label,
-                "model_name": model_meta.model_name,
-                "object_ids": object_ids})
-    return redirect_url
+    object_ids = selection.get_pk_list_token(pk_list, session)
+    return selection.get_redirect_url("massadmin_change_view", model_meta, object_ids)
 
 
 mass_change_selected.short_description = _('Mass Edit')
 
 
 def mass_change_view(request, app_name, model_name, object_ids, admin_site=None):
-    if object_ids.startswith("session-"):
-        object_ids = request.session.get(object_ids)
+    object_ids = selection.resolve_token(object_ids, request.session)
     model = get_model(app_name, model_name)
-    ma = MassAdmin(model, admin_site or admin.site)
+    ma = get_mass_admin(MassAdmin, admin_site or admin.site, model)
     return ma.mass_change_view(request, object_ids)
 
 
 mass_change_view = staff_member_required(mass_change_view)
 
 
+def mass_edit_job_status(request, job_id, admin_site=None):
+    """Progress of a queued mass edit, polled by the admin"""
+    from .jobs import job_status
+    from .models import MassEditJob
+
+    jobs = MassEditJob.objects.all()
+    if not request.user.is_superuser:
+        jobs = jobs.filter(user=request.user)
+    try:
+        job = jobs.get(pk=job_id)
+    except MassEditJob.DoesNotExist:
+        raise Http404(_('Mass edit job %(id)s does not exist.') % {'id': job_id})
+    return JsonResponse(job_status(job))
+
+
+mass_edit_job_status = staff_member_required(mass_edit_job_status)
+
+
 def get_formsets(model, request, obj=None):
+    """(FormSet class, inline instance) pairs"""
     try:  # Django>=1.9
-        return [f for f, _ in model.get_formsets_with_inlines(request, obj)]
+        return list(model.get_formsets_with_inlines(request, obj))
     except AttributeError:
-        return model.get_formsets(request, obj)
+        return list(zip(model.get_formsets(request, obj),
+                        model.get_inline_instances(request, obj)))
 
 
 class MassAdmin(admin.ModelAdmin):
 
     mass_change_form_template = None
+    job_engine = 'classic'
+    supports_expressions = False
 
     def __init__(self, model, admin_site):
         try:
@@ -128,6 +151,55 @@ class MassAdmin(admin.ModelAdmin):
 
         super(MassAdmin, self).__init__(model, admin_site)
 
+    @classmethod
+    def for_model(cls, model, admin_site):
+        return cls(model, admin_site)
+
+    def get_relation_widget(self, db_field, request, using=None):
+        """
+        Autocomplete (or, without search fields on the related admin, raw id)
+        widget for relations to more than LARGE_RELATION_THRESHOLD objects,
+        so the form doesn't render a select of the whole related table.
+        Fields of the admin's raw_id_fields/autocomplete_fields are left as is.
+        """
+        threshold = settings.LARGE_RELATION_THRESHOLD
+        if (not threshold
+                or db_field.name in self.raw_id_fields
+                or db_field.name in self.get_autocomplete_fields(request)):
+            return None
+        related_model = db_field.remote_field.model
+        # get_form builds the form twice, count once per request
+        counts = request.__dict__.setdefault('_massadmin_relation_counts', {})
+        if (related_model, using) not in counts:
+            # bounded count, so huge tables are not counted in full
+            counts[related_model, using] = related_model._default_manager.using(
+                using)[:threshold + 1].count()
+        if counts[related_model, using] <= threshold:
+            return None
+        related_admin = self.admin_site._registry.get(related_model)
+        if related_admin is not None and related_admin.get_search_fields(request):
+            if db_field.many_to_many:
+                return widgets.AutocompleteSelectMultiple(db_field, self.admin_site, using=using)
+            return widgets.AutocompleteSelect(db_field, self.admin_site, using=using)
+        if db_field.many_to_many:
+            return widgets.ManyToManyRawIdWidget(
+                db_field.remote_field, self.admin_site, using=using)
+        return widgets.ForeignKeyRawIdWidget(db_field.remote_field, self.admin_site, using=using)
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if 'widget' not in kwargs:
+            widget = self.get_relation_widget(db_field, request, kwargs.get('using'))
+            if widget is not None:
+                kwargs['widget'] = widget
+        return super(MassAdmin, self).formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        if 'widget' not in kwargs:
+            widget = self.get_relation_widget(db_field, request, kwargs.get('using'))
+            if widget is not None:
+                kwargs['widget'] = widget
+        return super(MassAdmin, self).formfield_for_manytomany(db_field, request, **kwargs)
+
     def get_overrided_properties(self):
         """
         Find all overrided properties, like form, raw_id_fields and so on.
@@ -141,9 +213,12 @@ class MassAdmin(admin.ModelAdmin):
                     items[k] = v
         return items
 
-    def response_change(self, request, obj):
+    def response_change(self, request, obj, changed_count=None, untouched_count=None):
         """
         Determines the HttpResponse for the change_view stage.
+
+        The counts are given when objects already having the posted values
+        were skipped.
         """
         opts = obj._meta
 
@@ -151,17 +226,106 @@ class MassAdmin(admin.ModelAdmin):
             'name': force_str(
                 opts.verbose_name_plural),
             'obj': force_str(obj)}
+        if untouched_count is not None:
+            msg = _('%(changed)s selected %(name)s were changed successfully, '
+                    '%(untouched)s already had these values.') % {
+                'name': force_str(opts.verbose_name_plural),
+                'changed': changed_count,
+                'untouched': untouched_count}
 
         self.message_user(request, msg)
+        return HttpResponseRedirect(self.get_changelist_redirect_url(request))
+
+    def get_changelist_redirect_url(self, request):
+        """Changelist url, keeping the filters the user came from"""
+        opts = self.model._meta
         redirect_url = reverse('{}:{}_{}_changelist'.format(
             self.admin_site.name,
-            self.model._meta.app_label,
-            self.model._meta.model_name,
+            opts.app_label,
+            opts.model_name,
         ))
         preserved_filters = self.get_preserved_filters(request)
-        redirect_url = add_preserved_filters(
+        return add_preserved_filters(
             {'preserved_filters': preserved_filters, 'opts': opts}, redirect_url)
-        return HttpResponseRedirect(redirect_url)
+
+    def skip_unchanged(self):
+        """Whether objects already having the posted values are left alone"""
+        return getattr(self.admin_obj, "massadmin_skip_unchanged", settings.SKIP_UNCHANGED)
+
+    def get_job_engine(self, request, ModelForm, mass_changes_fields):
+        return self.job_engine
+
+    def use_job_mode(self, request, ModelForm, mass_changes_fields):
+        """
+        Whether the edit should be queued for the worker instead of being
+        applied inside the request. Files and inlines can't be stored on a
+        job, so those edits always run synchronously, as do per-object edits
+        depending on admin save methods or on validation of every object.
+        """
+        if not getattr(self.admin_obj, "massadmin_job_mode", settings.JOB_MODE):
+            return False
+        if request.FILES:
+            return False
+        # inline prefixes may also be names of reverse relations of the model
+        if not all(field in ModelForm.base_fields for field in mass_changes_fields):
+            return False
+        file_fields = get_model_metadata(self.admin_site, self.model).file_fields
+        if any(field in file_fields for field in mass_changes_fields):
+            return False
+        if self.get_job_engine(request, ModelForm, mass_changes_fields) == ENGINE_CLASSIC:
+            reasons = get_job_obstacles(
+                self.admin_obj, self.model, ModelForm, mass_changes_fields)
+            if reasons:
+                logger.info('Mass edit of %s is not queued: %s',
+                            self.model._meta.label, '; '.join(reasons))
+                return False
+        return True
+
+    def enqueue_mass_change(
+            self, request, obj, object_ids, ModelForm, mass_changes_fields, engine=None,
+            queryset=None):
+        """
+        Validates the form once against the first object and stores the
+        cleaned values as a job for the massadmin_worker command, to be
+        applied by `engine` (job_engine by default) to the selected objects
+        found in `queryset`.
+        """
+        from .jobs import enqueue_job
+
+        form = ModelForm(request.POST, instance=obj)
+        for fieldname in list(form.fields):
+            if fieldname not in mass_changes_fields:
+                del form.fields[fieldname]
+
+        if not form.is_valid():
+            return ([], form.errors, helpers.AdminErrorList(form, []), None)
+
+        job = enqueue_job(
+            self.model,
+            object_ids,
+            form.cleaned_data,
+            user=request.user,
+            engine=engine or self.get_job_engine(request, ModelForm, mass_changes_fields),
+            queryset=queryset,
+            m2m_modes={
+                field.name: get_m2m_mode(request, field.name)
+                for field in self.model._meta.many_to_many
+                if field.name in form.cleaned_data})
+        self.message_user(request, _(
+            'Mass edit job #%(id)s for %(count)s %(name)s has been queued.') % {
+                'id': job.pk,
+                'count': job.total_count,
+                'name': force_str(self.model._meta.verbose_name_plural)})
+        selected_count = (
+            object_ids.count() if isinstance(object_ids, QuerySet) else len(object_ids))
+        if job.total_count < selected_count:
+            self.message_user(request, _(
+                '%(count)s selected %(name)s were not queued: they don\'t exist or '
+                'you can\'t change them.') % {
+                    'count': selected_count - job.total_count,
+                    'name': force_str(self.model._meta.verbose_name_plural)},
+                level=messages.WARNING)
+        return HttpResponseRedirect(self.get_changelist_redirect_url(request))
 
     def render_mass_change_form(
             self,
@@ -201,6 +365,107 @@ class MassAdmin(admin.ModelAdmin):
                 "admin/mass_change_form.html"],
             context)
 
+    def get_mass_change_log(self, request, form):
+        """
+        Admin log of the edit. The change message is built once from the
+        mass changed fields and entries are written in batches.
+        """
+        return MassChangeLog(
+            request.user.pk,
+            self.model,
+            change_message=get_fields_change_message(form),
+            mode=getattr(self.admin_obj, "massadmin_log_mode", None))
+
+    def can_bulk_update_m2m(self, field):
+        # m2m_changed receivers are only sent by the related manager
+        return supports_bulk_m2m(field) and not m2m_changed.has_listeners(
+            field.remote_field.through)
+
+    def get_m2m_updater(self, request, cleaned_data):
+        """
+        Many-to-many fields of the form are written for all the selected
+        objects at once, replacing or adding to their related objects.
+        """
+        values, modes = {}, {}
+        for field in self.model._meta.many_to_many:
+            if field.name in cleaned_data and self.can_bulk_update_m2m(field):
+                values[field.name] = [related.pk for related in cleaned_data[field.name]]
+                modes[field.name] = get_m2m_mode(request, field.name)
+        return BulkM2MUpdater(self.model, values, modes)
+
+    def get_added_m2m(self, request, cleaned_data, m2m_updater):
+        """
+        Related objects to add through the related manager, for the
+        many-to-many fields in M2M_ADD mode that m2m_updater can't write.
+        form.save_m2m() would replace them.
+        """
+        return {
+            field.name: list(cleaned_data[field.name])
+            for field in self.model._meta.many_to_many
+            if field.name in cleaned_data and field.name not in m2m_updater.values
+            and get_m2m_mode(request, field.name) == M2M_ADD}
+
+    def get_mass_change_formset_classes(self, request, obj, ModelForm, mass_changes_fields):
+        """
+        (prefix, FormSet class, inline instance) of the inlines selected for
+        mass change, looked up once per request. Inlines are not looked up at
+        all when only fields of the form are selected.
+        """
+        if all(field in ModelForm.base_fields for field in mass_changes_fields):
+            return []
+        formset_classes = []
+        prefixes = {}
+        for FormSet, inline in get_formsets(self, request, obj):
+            prefix = FormSet.get_default_prefix()
+            prefixes[prefix] = prefixes.get(prefix, 0) + 1
+            if prefixes[prefix] != 1:
+                prefix = "%s-%s" % (prefix, prefixes[prefix])
+            if prefix in mass_changes_fields:
+                formset_classes.append((prefix, FormSet, inline))
+        return formset_classes
+
+    def get_bulk_inlines(self, request, obj, formset_classes):
+        """
+        Splits the selected inlines between the ones edited for all objects
+        at once (their prefix is posted in _bulk_inline) and the ones saved
+        object by object. Returns (BulkInline list, remaining (prefix, FormSet
+        class) pairs). Raises PermissionDenied when a bulk inline posts
+        changes its inline doesn't allow.
+        """
+        bulk_prefixes = get_bulk_inline_prefixes(request)
+        bulk_inlines = [
+            BulkInline(FormSet, prefix, request, obj, inline=inline)
+            for prefix, FormSet, inline in formset_classes if prefix in bulk_prefixes]
+        for bulk_inline in bulk_inlines:
+            bulk_inline.check_permissions(request, obj)
+        formset_classes = [
+            (prefix, FormSet) for prefix, FormSet, inline in formset_classes
+            if prefix not in bulk_prefixes]
+        return bulk_inlines, formset_classes
+
+    def store_uploads(self, obj, cleaned_data):
+        """
+        Saves the files uploaded for file fields to their storage once, the
+        edited objects all get the returned {field name: stored name}.
+        """
+        stored_files = {}
+        for field_name, value in cleaned_data.items():
+            if isinstance(value, UploadedFile):
+                field = self.model._meta.get_field(field_name)
+                stored_files[field_name] = field.storage.save(
+                    field.generate_filename(obj, value.name), value,
+                    max_length=field.max_length)
+        return stored_files
+
+    def iter_selected_objects(self, queryset, object_ids):
+        """
+        Yields the selected objects, loading at most CHUNK_SIZE of them at a
+        time, so memory doesn't grow with the size of the selection.
+        """
+        for pk_filter, size in selection.iter_pk_filters(object_ids, settings.CHUNK_SIZE):
+            for obj in queryset.filter(pk_filter).order_by('pk').iterator():
+                yield obj
+
     def edit_all_values(self, request, queryset, object_ids, ModelForm, mass_changes_fields):
         """Edits given fields in given objects in an atomic transaction"""
 
@@ -210,11 +475,20 @@ class MassAdmin(admin.ModelAdmin):
         # commit only when all forms are valid
         try:
             with transaction.atomic():
-                objects_count = 0
-                changed_count = 0
-                objects = queryset.filter(pk__in=object_ids)
-                for obj in objects:
-                    objects_count += 1
+                new_object = None
+                history = None
+                m2m_updater = None
+                added_m2m = None
+                formset_classes = None
+                bulk_inlines = []
+                skip_unchanged = self.skip_unchanged()
+                changed_count = untouched_count = 0
+                stored_files = None
+                validation_span = instrumentation.Span('validation', self.model)
+                write_span = instrumentation.Span('write', self.model)
+                log_span = instrumentation.Span('log', self.model)
+                for obj in self.iter_selected_objects(queryset, object_ids):
+                    validation_span.start()
                     form = ModelForm(
                         request.POST,
                         request.FILES,
@@ -228,7 +502,9 @@ class MassAdmin(admin.ModelAdmin):
 
                     exclude = []
                     for fieldname, field in list(form.fields.items()):
-                        if fieldname not in mass_changes_fields:
+                        # uploads are validated with the first object only
+                        if fieldname not in mass_changes_fields or fieldname in (
+                                stored_files or ()):
                             exclude.append(fieldname)
 
                     for exclude_fieldname in exclude:
@@ -236,94 +512,257 @@ class MassAdmin(admin.ModelAdmin):
 
                     if form.is_valid():
                         form_validated = True
+                        if m2m_updater is None:
+                            m2m_updater = self.get_m2m_updater(request, form.cleaned_data)
+                            added_m2m = self.get_added_m2m(
+                                request, form.cleaned_data, m2m_updater)
+                        # written for all objects at once by m2m_updater
+                        for field_name in m2m_updater.values:
+                            del form.cleaned_data[field_name]
+                        for field_name in added_m2m:
+                            del form.cleaned_data[field_name]
+                        if stored_files is None:
+                            stored_files = self.store_uploads(obj, form.cleaned_data)
                         new_object = self.save_form(
                             request,
                             form,
                             change=True)
+                        # the stored file is shared instead of being saved again
+                        for field_name, stored_name in stored_files.items():
+                            setattr(new_object, field_name, stored_name)
                     else:
                         form_validated = False
                         new_object = obj
-                    prefixes = {}
-                    for FormSet in get_formsets(self, request, new_object):
-                        prefix = FormSet.get_default_prefix()
-                        prefixes[prefix] = prefixes.get(prefix, 0) + 1
-                        if prefixes[prefix] != 1:
-                            prefix = "%s-%s" % (prefix, prefixes[prefix])
-                        if prefix in mass_changes_fields:
-                            formset = FormSet(
-                                request.POST,
-                                request.FILES,
-                                instance=new_object,
-                                prefix=prefix)
-                            formsets.append(formset)
-
-                    if all_valid(formsets) and form_validated:
-                        # self.admin_obj.save_model(request, new_object, form, change=True)
-                        self.save_model(
+                    if formset_classes is None:
+                        formset_classes = self.get_mass_change_formset_classes(
+                            request, new_object, ModelForm, mass_changes_fields)
+                        bulk_inlines, formset_classes = self.get_bulk_inlines(
+                            request, new_object, formset_classes)
+                        # validated once, applied to all objects
+                        if not all([bulk_inline.is_valid() for bulk_inline in bulk_inlines]):
+                            # shown with the errors of the form
+                            for bulk_inline in bulk_inlines:
+                                for error_list in bulk_inline.errors:
+                                    form.add_error(None, error_list)
+                            errors = form.errors
+                            errors_list = helpers.AdminErrorList(form, [])
+                            raise ValidationError("Not all forms is correct")
+                    # inline formsets of this object only, so that earlier objects
+                    # are not validated and saved again on every iteration
+                    formsets = [
+                        FormSet(
+                            request.POST,
+                            request.FILES,
+                            instance=new_object,
+                            prefix=prefix)
+                        for prefix, FormSet in formset_classes]
+
+                    if not (all_valid(formsets) and form_validated):
+                        # Show the errors of the first invalid object, nothing is saved
+                        errors = form.errors
+                        errors_list = helpers.AdminErrorList(form, formsets)
+                        # Raise error for rollback transaction in atomic block
+                        raise ValidationError("Not all forms is correct")
+                    validation_span.stop()
+                    validation_span.rows += 1
+
+                    write_span.start()
+                    for bulk_inline in bulk_inlines:
+                        bulk_inline.add(new_object.pk)
+                    if skip_unchanged and not stored_files and not form.has_changed() and not any(
+                            formset.has_changed() for formset in formsets):
+                        # already has the posted values: neither saved nor logged
+                        write_span.stop()
+                        untouched_count += 1
+                        continue
+                    changed_count += 1
+
+                    # self.admin_obj.save_model(request, new_object, form, change=True)
+                    self.save_model(
+                        request,
+                        new_object,
+                        form,
+                        change=True)
+                    form.save_m2m()
+                    for field_name, related_objects in added_m2m.items():
+                        getattr(new_object, field_name).add(*related_objects)
+                    m2m_updater.add(new_object.pk)
+                    for formset in formsets:
+                        self.save_formset(
                             request,
-                            new_object,
                             form,
+                            formset,
                             change=True)
-                        form.save_m2m()
-                        for formset in formsets:
-                            self.save_formset(
-                                request,
-                                form,
-                                formset,
-                                change=True)
-
-                        change_message = self.construct_change_message(
+                    write_span.stop()
+                    write_span.rows += 1
+                    if write_span.rows >= settings.CHUNK_SIZE:
+                        write_span.emit()
+
+                    log_span.start()
+                    if history is None:
+                        history = self.get_mass_change_log(request, form)
+                    if formsets:
+                        # inline changes differ from one object to another
+                        history.add(new_object, self.construct_change_message(
                             request,
                             form,
-                            formsets)
-                        self.log_change(
-                            request,
-                            new_object,
-                            change_message)
-                        changed_count += 1
-
-                if changed_count == objects_count:
-                    return self.response_change(request, new_object)
-                else:
-                    errors = form.errors
-                    errors_list = helpers.AdminErrorList(form, formsets)
-                    # Raise error for rollback transaction in atomic block
-                    raise ValidationError("Not all forms is correct")
+                            formsets))
+                    else:
+                        history.add(new_object)
+                    log_span.stop()
+                    log_span.rows += 1
+
+                write_span.start()
+                if m2m_updater is not None:
+                    m2m_updater.flush()
+                for bulk_inline in bulk_inlines:
+                    bulk_inline.flush()
+                write_span.stop()
+                log_span.start()
+                if history is not None:
+                    history.close()
+                log_span.stop()
+                validation_span.emit()
+                write_span.emit()
+                log_span.emit()
+                if skip_unchanged:
+                    return self.response_change(
+                        request, new_object, changed_count, untouched_count)
+                return self.response_change(request, new_object)
 
         except Exception:
             general_error = sys.exc_info()[1]
 
         return (formsets, errors, errors_list, general_error)
 
+    def edit_from_file(self, request, queryset, object_ids, ModelForm):
+        """
+        Gives each selected object the values of its row in the uploaded
+        CSV/TSV file, see massadmin.csv_update.
+        """
+        metadata = get_model_metadata(self.admin_site, self.model)
+        fields = metadata.editable_fields - metadata.m2m_fields - metadata.file_fields
+        history = MassChangeLog(
+            request.user.pk,
+            self.model,
+            mode=getattr(self.admin_obj, "massadmin_log_mode", None))
+        try:
+            with transaction.atomic():
+                updated, rows_count = CsvUpdate(
+                    queryset, object_ids, ModelForm, fields, history=history,
+                    admin_obj=self.admin_obj).run(
+                        request.FILES[CSV_FILE])
+        except CsvUpdateError as e:
+            return ([], None, None, e)
+        self.message_user(request, _(
+            '%(updated)s %(name)s were changed from %(rows)s rows of the file.') % {
+                'updated': updated,
+                'name': force_str(self.model._meta.verbose_name_plural),
+                'rows': rows_count})
+        return HttpResponseRedirect(self.get_changelist_redirect_url(request))
+
+    def get_permitted_queryset(self, request, queryset):
+        """
+        Objects of `queryset` the user may change, given by the admin's
+        massadmin_permitted_queryset(request, queryset) method. None when the
+        admin has no such method, only the first object is checked then.
+        """
+        get_permitted = getattr(self.admin_obj, "massadmin_permitted_queryset", None)
+        if get_permitted is None:
+            return None
+        return get_permitted(request, queryset)
+
+    def get_forbidden_ids(self, queryset, permitted_queryset, object_ids):
+        """
+        The first MAX_REPORTED_IDS selected objects that are not permitted.
+        The selection is checked with one query (one per chunk for long pk
+        lists) instead of a permission check per object.
+        """
+        if isinstance(object_ids, QuerySet):
+            pk_filters = [Q(pk__in=object_ids)]
+        else:
+            pk_filters = (pk_filter for pk_filter, size
+                          in selection.iter_pk_filters(object_ids, settings.CHUNK_SIZE))
+        forbidden_ids = []
+        for pk_filter in pk_filters:
+            forbidden_ids.extend(queryset.filter(pk_filter).exclude(
+                pk__in=permitted_queryset.values('pk')).order_by('pk').values_list(
+                'pk', flat=True)[:MAX_REPORTED_IDS - len(forbidden_ids)])
+            if len(forbidden_ids) >= MAX_REPORTED_IDS:
+                break
+        return forbidden_ids
+
+    def get_object_ids(self, request, queryset, comma_separated_object_ids):
+        """
+        Primary keys of the selected objects, either as a list (an array for
+        integer pks) or, for "select all" selections, as a lazy queryset of pks.
+        """
+        if not comma_separated_object_ids:
+            raise Http404(_('The selection of objects has expired, please select them again.'))
+        try:
+            if selection.is_query_selection(comma_separated_object_ids):
+                # filters of stale or edited urls may no longer exist
+                return selection.get_query_selection_ids(
+                    self.admin_obj, request, queryset, comma_separated_object_ids)
+            return selection.parse_pk_list(comma_separated_object_ids)
+        except (ValueError, IncorrectLookupParameters):
+            raise Http404(_('Invalid selection of objects.'))
+
     def mass_change_view(
             self,
             request,
             comma_separated_object_ids,
             extra_context=None):
         """The 'mass change' admin view for this model."""
+        with instrumentation.track_queries(self.model):
+            return self._mass_change_view(
+                request, comma_separated_object_ids, extra_context)
+
+    def _mass_change_view(
+            self,
+            request,
+            comma_separated_object_ids,
+            extra_context=None):
         global new_object
         model = self.model
         opts = model._meta
         general_error = None
 
-        # Allow model to hide some fields for mass admin
-        exclude_fields = getattr(self.admin_obj, "massadmin_exclude", ())
+        metadata = get_model_metadata(self.admin_site, model)
         queryset = getattr(
             self.admin_obj,
             "massadmin_queryset",
             self.get_queryset)(request)
 
-        object_ids = comma_separated_object_ids.split(',')
-        object_id = object_ids[0]
+        with instrumentation.span('decode', model) as decode_span:
+            object_ids = self.get_object_ids(request, queryset, comma_separated_object_ids)
+            edited_count, selected_count, missing_ids = selection.count_selection(
+                queryset, object_ids, settings.CHUNK_SIZE, MAX_REPORTED_IDS)
+            decode_span.rows = selected_count
+        object_id = next(iter(object_ids[:1]), None)
 
-        try:
-            obj = queryset.get(pk=unquote(object_id))
-        except model.DoesNotExist:
-            obj = None
-
-        # TODO It's necessary to check permission and existence for all object
-        if not self.has_change_permission(request, obj):
-            raise PermissionDenied
+        obj = None
+        if edited_count:
+            try:
+                obj = queryset.get(pk=unquote(str(object_id)))
+            except model.DoesNotExist:
+                # the first selected object is gone, show the first one left
+                obj = next(self.iter_selected_objects(queryset, object_ids))
+                object_id = obj.pk
+
+        with instrumentation.span('permission', model, rows=edited_count):
+            if not self.has_change_permission(request, obj):
+                raise PermissionDenied
+
+            permitted_queryset = self.get_permitted_queryset(request, queryset)
+            if permitted_queryset is not None:
+                forbidden_ids = self.get_forbidden_ids(queryset, permitted_queryset, object_ids)
+                if forbidden_ids:
+                    raise PermissionDenied(
+                        _('You are not allowed to change the selected %(name)s %(ids)s.') % {
+                            'name': force_str(opts.verbose_name_plural),
+                            'ids': ', '.join(str(pk) for pk in forbidden_ids)})
+                queryset = permitted_queryset
 
         if obj is None:
             raise Http404(
@@ -335,15 +774,30 @@ class MassAdmin(admin.ModelAdmin):
         ModelForm = self.get_form(request, obj)
         formsets = []
         errors, errors_list = None, None
-        mass_changes_fields = request.POST.getlist("_mass_change")
+        # unique and excluded fields can't be mass changed
+        mass_changes_fields = [
+            field for field in request.POST.getlist("_mass_change")
+            if field not in metadata.unique_fields and field not in metadata.exclude_fields]
         if request.method == 'POST':
-            response = self.edit_all_values(
-                request,
-                queryset,
-                object_ids,
-                ModelForm,
-                mass_changes_fields
-            )
+            if CSV_FILE in request.FILES:
+                response = self.edit_from_file(request, queryset, object_ids, ModelForm)
+            elif self.use_job_mode(request, ModelForm, mass_changes_fields):
+                response = self.enqueue_mass_change(
+                    request,
+                    obj,
+                    object_ids,
+                    ModelForm,
+                    mass_changes_fields,
+                    queryset=queryset
+                )
+            else:
+                response = self.edit_all_values(
+                    request,
+                    queryset,
+                    object_ids,
+                    ModelForm,
+                    mass_changes_fields
+                )
 
             if type(response) is tuple:
                 formsets, errors, errors_list, general_error = response
@@ -352,14 +806,7 @@ class MassAdmin(admin.ModelAdmin):
 
         form = ModelForm(instance=obj)
         form._errors = errors
-        prefixes = {}
-        for FormSet in get_formsets(self, request, obj):
-            prefix = FormSet.get_default_prefix()
-            prefixes[prefix] = prefixes.get(prefix, 0) + 1
-            if prefixes[prefix] != 1:
-                prefix = "%s-%s" % (prefix, prefixes[prefix])
-            formset = FormSet(instance=obj, prefix=prefix)
-            formsets.append(formset)
+        # inline formsets are not built, the template doesn't display them
 
         adminForm = helpers.AdminForm(
             form=form,
@@ -370,17 +817,6 @@ class MassAdmin(admin.ModelAdmin):
         )
         media = self.media + adminForm.media
 
-        # We don't want the user trying to mass change unique fields!
-        unique_fields = []
-        fields = model._meta.get_fields()
-        for field_name in fields:
-            try:
-                field = model._meta.get_field(field_name)
-                if field.unique:
-                    unique_fields.append(field_name)
-            except Exception:
-                pass
-
         # Buggy! Use at your own risk
         # inline_admin_formsets = []
         # for inline, formset in zip(self.inline_instances, formsets):
@@ -394,8 +830,10 @@ class MassAdmin(admin.ModelAdmin):
             'adminform': adminForm,
             'object_id': object_id,
             'original': obj,
-            'unique_fields': unique_fields,
-            'exclude_fields': exclude_fields,
+            # We don't want the user trying to mass change unique fields!
+            'unique_fields': metadata.unique_fields,
+            # Allow model to hide some fields for mass admin
+            'exclude_fields': metadata.exclude_fields,
             'is_popup': '_popup' in request.GET or '_popup' in request.POST,
             'media': mark_safe(media),
             # 'inline_admin_formsets': inline_admin_formsets,
@@ -404,14 +842,22 @@ class MassAdmin(admin.ModelAdmin):
             'app_label': opts.app_label,
             'object_ids': comma_separated_object_ids,
             'mass_changes_fields': mass_changes_fields,
+            'm2m_fields': metadata.m2m_fields,
+            # fields offered database side operators
+            'numeric_fields': metadata.numeric_fields if self.supports_expressions else (),
+            'text_fields': metadata.text_fields if self.supports_expressions else (),
+            'edited_count': edited_count,
+            'selected_count': selected_count,
+            'missing_ids': missing_ids,
         }
         context.update(self.admin_site.each_context(request))
         context.update(extra_context or {})
-        return self.render_mass_change_form(
-            request,
-            context,
-            change=True,
-            obj=obj)
+        with instrumentation.span('render', model, rows=edited_count):
+            return self.render_mass_change_form(
+                request,
+                context,
+                change=True,
+                obj=obj)
 
 
 class MassEditMixin:
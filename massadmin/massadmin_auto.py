@@ -0,0 +1,79 @@
+from django.apps import apps
+from django.contrib import admin
+from django.utils.translation import gettext_lazy as _
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponseRedirect
+
+from . import selection
+from . import massadmin
+from .cache import get_mass_admin
+from .engines import ENGINE_CLASSIC, select_engine
+from .inlines import get_bulk_inline_prefixes
+from .massadmin_improved import MassAdminImproved
+
+
+def mass_change_selected(modeladmin, request, queryset):
+    """Create MassAdminAuto url containing all selected items"""
+    redirect_url = selection.get_action_redirect_url(
+        "auto_massadmin_change_view", modeladmin, request, queryset)
+    return HttpResponseRedirect(redirect_url)
+
+
+def get_mass_change_redirect_url(model_meta, pk_list, session):
+    """Get MassAdminAuto url"""
+    object_ids = selection.get_pk_list_token(pk_list, session)
+    return selection.get_redirect_url("auto_massadmin_change_view", model_meta, object_ids)
+
+
+mass_change_selected.short_description = _('Mass Edit')
+
+
+def mass_change_view(request, app_name, model_name, object_ids, admin_site=None):
+    """Handles response using MassAdminAuto pages"""
+    object_ids = selection.resolve_token(object_ids, request.session)
+    ma = get_mass_admin(
+        MassAdminAuto, admin_site or admin.site, apps.get_model(app_name, model_name))
+    return ma.mass_change_view(request, object_ids)
+
+
+mass_change_view = staff_member_required(mass_change_view)
+
+
+class MassAdminAuto(MassAdminImproved):
+    """
+    Applies each mass edit with the bulk engine when it is equivalent to
+    saving every object, and with the per-object engine otherwise.
+    """
+
+    # the per-object engine can't apply operators
+    supports_expressions = False
+
+    def select_engine(self, request, ModelForm, mass_changes_fields):
+        # bulk inlines are set based with both engines
+        bulk_prefixes = get_bulk_inline_prefixes(request)
+        fields = tuple(field for field in mass_changes_fields if field not in bulk_prefixes)
+        # use_job_mode and edit_all_values both ask, choose (and log) once per request
+        engines = request.__dict__.setdefault('_massadmin_engines', {})
+        if (self.model, fields) not in engines:
+            engines[self.model, fields], reasons = select_engine(
+                self.admin_obj, self.model, ModelForm, list(fields))
+        return engines[self.model, fields]
+
+    def can_bulk_update_m2m(self, field):
+        return massadmin.MassAdmin.can_bulk_update_m2m(self, field)
+
+    def get_job_engine(self, request, ModelForm, mass_changes_fields):
+        return self.select_engine(request, ModelForm, mass_changes_fields)
+
+    def edit_all_values(self, request, queryset, object_ids, ModelForm, mass_changes_fields):
+        if self.select_engine(request, ModelForm, mass_changes_fields) == ENGINE_CLASSIC:
+            return massadmin.MassAdmin.edit_all_values(
+                self, request, queryset, object_ids, ModelForm, mass_changes_fields)
+        return super(MassAdminAuto, self).edit_all_values(
+            request, queryset, object_ids, ModelForm, mass_changes_fields)
+
+
+class AutoMassEditMixin:
+    actions = (
+        mass_change_selected,
+    )
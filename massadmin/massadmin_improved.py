@@ -1,11 +1,5 @@
-import hashlib
-
 from django.contrib import admin
 from django.core.exceptions import ValidationError
-try:
-    from django.urls import reverse
-except ImportError:  # Django<2.0
-    from django.core.urlresolvers import reverse
 try:  # Django>=1.9
     from django.apps import apps
     get_model = apps.get_model
@@ -18,41 +12,31 @@ except ImportError:
 from django.utils.translation import gettext_lazy as _
 from django.contrib.admin.views.decorators import staff_member_required
 from django.http import HttpResponseRedirect
-from django.contrib.admin.templatetags.admin_urls import add_preserved_filters
-from django.db import transaction
+from django.db import connections, router, transaction
+from django.db.models import Q
 
-from . import settings
+from . import instrumentation
+from . import selection
 from . import massadmin
+from .cache import get_mass_admin, get_model_metadata
+from .chunking import get_update_chunk_sizer
+from .expressions import apply_mass_ops, get_mass_ops
+from .signals import has_mass_update_receivers, mass_post_update, mass_pre_update
 import sys
+import time
 
 
 def mass_change_selected(modeladmin, request, queryset):
     """Create MassAdminImproved url containing all selected items"""
-    selected = queryset.values_list('pk', flat=True)
-
-    redirect_url = get_mass_change_redirect_url(modeladmin.model._meta, selected, request.session)
-    redirect_url = add_preserved_filters(
-        {'preserved_filters': modeladmin.get_preserved_filters(request),
-         'opts': queryset.model._meta},
-        redirect_url)
-
+    redirect_url = selection.get_action_redirect_url(
+        "improved_massadmin_change_view", modeladmin, request, queryset)
     return HttpResponseRedirect(redirect_url)
 
 
 def get_mass_change_redirect_url(model_meta, pk_list, session):
     """Get MassAdminImproved url"""
-    object_ids = ",".join(str(s) for s in pk_list)
-    if len(object_ids) > settings.SESSION_BASED_URL_THRESHOLD:
-        hash_id = "session-%s" % hashlib.md5(object_ids.encode('utf-8')).hexdigest()
-        session[hash_id] = object_ids
-        session.save()
-        object_ids = hash_id
-    redirect_url = reverse(
-        "improved_massadmin_change_view",
-        kwargs={"app_name": model_meta.app_label,
-                "model_name": model_meta.model_name,
-                "object_ids": object_ids})
-    return redirect_url
+    object_ids = selection.get_pk_list_token(pk_list, session)
+    return selection.get_redirect_url("improved_massadmin_change_view", model_meta, object_ids)
 
 
 mass_change_selected.short_description = _('Mass Edit')
@@ -60,9 +44,9 @@ mass_change_selected.short_description = _('Mass Edit')
 
 def mass_change_view(request, app_name, model_name, object_ids, admin_site=None):
     """Handles response using MassAdminImproved pages"""
-    if object_ids.startswith("session-"):
-        object_ids = request.session.get(object_ids)
-    ma = MassAdminImproved(app_name, model_name, admin_site or admin.site,)
+    object_ids = selection.resolve_token(object_ids, request.session)
+    ma = get_mass_admin(
+        MassAdminImproved, admin_site or admin.site, get_model(app_name, model_name))
     return ma.mass_change_view(request, object_ids)
 
 
@@ -72,6 +56,8 @@ mass_change_view = staff_member_required(mass_change_view)
 class MassAdminImproved(massadmin.MassAdmin):
 
     mass_change_form_template = None
+    job_engine = 'bulk'
+    supports_expressions = True
 
     def __init__(self, app_name, model_name, admin_site):
         self.app_name = app_name
@@ -81,6 +67,10 @@ class MassAdminImproved(massadmin.MassAdmin):
 
         super(MassAdminImproved, self).__init__(model, admin_site)
 
+    @classmethod
+    def for_model(cls, model, admin_site):
+        return cls(model._meta.app_label, model._meta.model_name, admin_site)
+
     def get_mass_change_data(self, request):
         """Compiles mass_change fields into a dictionary"""
         data = {}
@@ -130,28 +120,116 @@ class MassAdminImproved(massadmin.MassAdmin):
 
         return form.cleaned_data
 
+    def use_job_mode(self, request, ModelForm, mass_changes_fields):
+        # operators can't be stored on a job
+        if get_mass_ops(request, self.model):
+            return False
+        return super(MassAdminImproved, self).use_job_mode(
+            request, ModelForm, mass_changes_fields)
+
+    def can_bulk_update_m2m(self, field):
+        # update() can't write any many-to-many field, bulk_set_m2m handles
+        # custom through models object by object
+        return True
+
     def edit_all_values(self, request, queryset, object_ids, ModelForm, mass_changes_fields):
-        object_id = object_ids[0]
+        object_id = next(iter(object_ids[:1]), None)
         formsets = []
         errors, errors_list = None, None
 
         try:
-            obj = queryset.get(pk=unquote(object_id))
-
-            data = self.get_mass_change_data(request)
-
-            data = self.validate_form(request, ModelForm, mass_changes_fields, obj, data)
+            obj = queryset.filter(pk=unquote(str(object_id))).first()
+            if obj is None:
+                # validate against the first selected object that still exists
+                obj = next(self.iter_selected_objects(queryset, object_ids))
+
+            with instrumentation.span('validation', self.model, rows=1):
+                data = self.get_mass_change_data(request)
+
+                data = self.validate_form(request, ModelForm, mass_changes_fields, obj, data)
+
+                # other inlines can't be edited with update()
+                bulk_inlines, formset_classes = self.get_bulk_inlines(
+                    request, obj, self.get_mass_change_formset_classes(
+                        request, obj, ModelForm, mass_changes_fields))
+                if not all([bulk_inline.is_valid() for bulk_inline in bulk_inlines]):
+                    raise ValidationError([
+                        error_list
+                        for bulk_inline in bulk_inlines
+                        for error_list in bulk_inline.errors])
+
+            # update() would only write the name of the upload
+            data.update(self.store_uploads(obj, data))
+            for field_name in get_model_metadata(self.admin_site, self.model).file_fields:
+                if field_name not in data or isinstance(data[field_name], str):
+                    continue
+                if data[field_name] is False:
+                    # "Clear" was checked
+                    data[field_name] = ''
+                else:
+                    # no upload, the form gave the file of the first object
+                    del data[field_name]
+
+            m2m_updater = self.get_m2m_updater(request, data)
+            for field_name in m2m_updater.values:
+                del data[field_name]
+            data = apply_mass_ops(request, self.model, data)
+
+            using = router.db_for_write(self.model)
+            chunk_sizer = get_update_chunk_sizer(connections[using], len(data))
+            send_signals = has_mass_update_receivers(self.model)
+            signal_values = dict(data, **m2m_updater.values)
+            # rows already having every value are not written, unless some
+            # value is computed from the current one
+            unchanged = None
+            if self.skip_unchanged() and data and not any(
+                    hasattr(value, 'resolve_expression') for value in data.values()):
+                unchanged = Q(**data)
+            changed_count = untouched_count = 0
 
             # In case of errors Atomic will rollback whole transaction
             with transaction.atomic():
-                i = 0
-                while i < len(object_ids):
+                for pk_filter, size in selection.iter_pk_filters(object_ids, chunk_sizer):
+                    started = time.monotonic()
+                    write_span = instrumentation.Span('write', self.model)
+                    write_span.start()
+                    chunk_queryset = queryset.filter(pk_filter)
+                    pks = None
+                    if (send_signals or m2m_updater.values or bulk_inlines
+                            or unchanged is not None):
+                        pks = list(chunk_queryset.values_list('pk', flat=True))
+                        if not pks:
+                            continue
+                        chunk_queryset = queryset.filter(selection.get_pk_filter(pks))
+                    if send_signals:
+                        mass_pre_update.send(
+                            sender=self.model, pks=pks, fields=list(signal_values),
+                            values=signal_values, using=using)
                     # Update will trigger all checks before actually saving the data,
                     # making it more optimized than manually checking before updating
-                    queryset.filter(pk__in=object_ids[i: i + 500]).update(**data)
-                    i += 500
-
-            return self.response_change(request, queryset.filter(pk__in=[object_id]).first())
+                    updated = 0
+                    if unchanged is not None:
+                        changed = chunk_queryset.exclude(unchanged).update(**data)
+                        changed_count += changed
+                        untouched_count += len(pks) - changed
+                    elif data:
+                        updated = chunk_queryset.update(**data)
+                    if m2m_updater.values:
+                        m2m_updater.apply(pks)
+                    for bulk_inline in bulk_inlines:
+                        bulk_inline.apply(pks)
+                    if send_signals:
+                        mass_post_update.send(
+                            sender=self.model, pks=pks, fields=list(signal_values),
+                            values=signal_values, using=using)
+                    chunk_sizer.record(size, time.monotonic() - started)
+                    write_span.stop()
+                    write_span.rows = len(pks) if pks is not None else updated
+                    write_span.emit()
+
+            if unchanged is not None:
+                return self.response_change(request, obj, changed_count, untouched_count)
+            return self.response_change(request, obj)
 
         # We have to catch all exceptions here due to atomic's
         # ability to return almost any error
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('massadmin', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MassEditSelection',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64, unique=True)),
+                ('selection', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'mass edit selection',
+                'verbose_name_plural': 'mass edit selections',
+            },
+        ),
+    ]
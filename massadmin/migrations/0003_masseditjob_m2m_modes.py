@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('massadmin', '0002_masseditselection'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='masseditjob',
+            name='m2m_modes',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('massadmin', '0003_masseditjob_m2m_modes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='masseditjob',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class MassEditJob(models.Model):
+    """A mass edit queued to be applied outside of the admin request"""
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, _('Pending')),
+        (STATUS_RUNNING, _('Running')),
+        (STATUS_DONE, _('Done')),
+        (STATUS_FAILED, _('Failed')),
+    )
+
+    ENGINE_CLASSIC = 'classic'
+    ENGINE_BULK = 'bulk'
+    ENGINE_CHOICES = (
+        (ENGINE_CLASSIC, _('Per-object save')),
+        (ENGINE_BULK, _('Bulk update')),
+    )
+
+    app_label = models.CharField(max_length=100)
+    model_name = models.CharField(max_length=100)
+    engine = models.CharField(max_length=16, choices=ENGINE_CHOICES, default=ENGINE_CLASSIC)
+    object_ids = models.TextField()
+    values = models.TextField()
+    m2m_modes = models.TextField(blank=True, default='')
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+    )
+    status = models.CharField(
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING,
+        db_index=True,
+    )
+    total_count = models.PositiveIntegerField(default=0)
+    processed_count = models.PositiveIntegerField(default=0)
+    changed_count = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    errors = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # last progress of the worker running the job
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('pk',)
+        verbose_name = _('mass edit job')
+        verbose_name_plural = _('mass edit jobs')
+
+    def __str__(self):
+        return '%s.%s #%s (%s)' % (self.app_label, self.model_name, self.pk, self.status)
+
+
+class MassEditSelection(models.Model):
+    """Objects selected for a mass edit, referenced by a token in the url"""
+
+    token = models.CharField(max_length=64, unique=True)
+    selection = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = _('mass edit selection')
+        verbose_name_plural = _('mass edit selections')
+
+    def __str__(self):
+        return self.token
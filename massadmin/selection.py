@@ -0,0 +1,390 @@
+"""
+Encoding of the objects selected for a mass edit into the mass change url.
+
+A selection is either a list of primary keys or, when the user selected all
+objects matching the changelist, a "query" selection which stores the
+changelist parameters (filters, search) and is re-evaluated on the server when
+the edit runs, so its size doesn't depend on the number of rows.
+
+Integer primary keys are stored as a compact "pk set": the sorted pks are
+split into runs of consecutive values, each run is stored as varints (gap from
+the previous run, run length) and the result is zlib compressed when that
+helps. Dense selections of millions of rows fit in a few bytes. Other primary
+keys are stored comma separated.
+"""
+import base64
+import binascii
+import copy
+import itertools
+import zlib
+from array import array
+
+from django import forms
+from django.db.models import Q
+from django.db.models.query import QuerySet
+from django.http import QueryDict
+try:
+    from django.urls import reverse
+except ImportError:  # Django<2.0
+    from django.core.urlresolvers import reverse
+from django.contrib.admin.templatetags.admin_urls import add_preserved_filters
+
+from . import settings
+from .stores import get_selection_store
+
+SESSION_PREFIX = "session-"
+QUERY_PREFIX = "query-"
+PK_SET_PREFIX = "ids-"
+
+# Shortest run of consecutive pks filtered with BETWEEN rather than IN
+MIN_RANGE_LENGTH = 3
+
+_RAW = 0
+_ZLIB = 1
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def _b64decode(encoded):
+    return base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _iter_varints(data):
+    value, shift = 0, 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            yield value
+            value, shift = 0, 0
+    if shift:
+        raise ValueError("Truncated pk set")
+
+
+def iter_runs(pks):
+    """
+    Yields (first, last) of every run of consecutive values of sorted `pks`,
+    which may be any iterable: it's only iterated once.
+    """
+    start = end = None
+    for pk in pks:
+        if end is not None and pk == end + 1:
+            end = pk
+            continue
+        if end is not None:
+            yield start, end
+        start = end = pk
+    if end is not None:
+        yield start, end
+
+
+def _encode_runs(runs):
+    """pk set token of (first, last) runs given in ascending order"""
+    out = bytearray()
+    previous_end = None
+    for start, end in runs:
+        if previous_end is None:
+            # zigzag, so that negative pks are supported too
+            _write_varint(out, start * 2 if start >= 0 else -start * 2 - 1)
+        else:
+            _write_varint(out, start - previous_end)
+        _write_varint(out, end - start)
+        previous_end = end
+
+    compressed = zlib.compress(bytes(out), 9)
+    if len(compressed) < len(out):
+        payload = bytes([_ZLIB]) + compressed
+    else:
+        payload = bytes([_RAW]) + out
+    return PK_SET_PREFIX + _b64encode(payload)
+
+
+def encode_pk_set(pk_list):
+    """
+    Encodes integer pks as a url safe pk set token.
+
+    Returns None when some pk isn't an integer.
+    """
+    pks = set(pk_list)
+    if not all(type(pk) is int for pk in pks):
+        return None
+    return _encode_runs(iter_runs(sorted(pks)))
+
+
+def encode_sorted_pks(pks):
+    """
+    Encodes pks given in strictly ascending order as they are iterated, so
+    that a selection of any size is never held in memory as a list.
+
+    Returns (token, number of pks). Integer pks are encoded as a pk set,
+    others are comma separated, like encode_pk_list.
+    """
+    pks = iter(pks)
+    first = next(pks, None)
+    if first is None:
+        return encode_pk_list([]), 0
+    if type(first) is not int:
+        parts = [str(first)]
+        parts.extend(str(pk) for pk in pks)
+        return ",".join(parts), len(parts)
+
+    count = 0
+
+    def ascending():
+        nonlocal count
+        previous = None
+        for pk in itertools.chain([first], pks):
+            if previous is not None and pk <= previous:
+                raise ValueError("pks are not in ascending order")
+            count += 1
+            previous = pk
+            yield pk
+
+    token = _encode_runs(iter_runs(ascending()))
+    return token, count
+
+
+def decode_pk_set(selection, max_size=None):
+    """
+    Decodes a pk set token straight into an array of ascending integers.
+
+    A few bytes can stand for billions of pks, so tokens of more than
+    `max_size` pks (MAX_PK_SET_SIZE by default) raise ValueError before
+    they are expanded.
+    """
+    if max_size is None:
+        max_size = settings.MAX_PK_SET_SIZE
+    try:
+        payload = _b64decode(selection[len(PK_SET_PREFIX):])
+        if not payload or payload[0] not in (_RAW, _ZLIB):
+            raise ValueError("Unknown pk set format")
+        data = payload[1:] if payload[0] == _RAW else zlib.decompress(payload[1:])
+    except (binascii.Error, zlib.error) as e:
+        raise ValueError("Invalid pk set: %s" % e)
+
+    pks = array('q')
+    values = _iter_varints(data)
+    previous_end = None
+    for value in values:
+        if previous_end is None:
+            start = value // 2 if not value % 2 else -(value + 1) // 2
+        elif value < 2:
+            # runs are separated by at least one missing pk
+            raise ValueError("Invalid pk set: overlapping runs")
+        else:
+            start = previous_end + value
+        length = next(values, None)
+        if length is None:
+            raise ValueError("Truncated pk set")
+        end = start + length
+        if len(pks) + length + 1 > max_size:
+            raise ValueError("Pk set of more than %s pks" % max_size)
+        try:
+            pks.extend(range(start, end + 1))
+        except OverflowError as e:
+            raise ValueError("Invalid pk set: %s" % e)
+        previous_end = end
+    return pks
+
+
+def is_pk_set(selection):
+    return selection.startswith(PK_SET_PREFIX)
+
+
+def parse_pk_list(selection, max_size=None):
+    """Primary keys of a pk set or comma separated selection"""
+    if is_pk_set(selection):
+        return decode_pk_set(selection, max_size)
+    return selection.split(',')
+
+
+def encode_pk_list(pk_list):
+    """Compact representation of a pk list, falls back to comma separated"""
+    return encode_pk_set(pk_list) or ",".join(str(s) for s in pk_list)
+
+
+def get_selection_token(selection, session):
+    """Moves selections longer than the threshold into the selection store"""
+    if len(selection) > settings.SESSION_BASED_URL_THRESHOLD:
+        return get_selection_store().save(selection, session)
+    return selection
+
+
+def get_pk_list_token(pk_list, session):
+    return get_selection_token(encode_pk_list(pk_list), session)
+
+
+def get_query_token(params, session):
+    """Token of a selection made of all objects matching changelist `params`"""
+    return get_selection_token(QUERY_PREFIX + _b64encode(params.encode('utf-8')), session)
+
+
+def resolve_token(token, session):
+    """
+    Returns the selection a token from the url stands for, None if the
+    stored selection expired.
+    """
+    store = get_selection_store()
+    if store.owns(token):
+        return store.load(token, session)
+    if token.startswith(SESSION_PREFIX):
+        # urls created before the selection store was configured
+        return session.get(token)
+    return token
+
+
+def is_query_selection(selection):
+    return selection.startswith(QUERY_PREFIX)
+
+
+def decode_query_selection(selection):
+    return QueryDict(_b64decode(selection[len(QUERY_PREFIX):]).decode('utf-8'))
+
+
+def get_query_selection_ids(model_admin, request, queryset, selection):
+    """
+    Re-evaluates a query selection through the changelist of `model_admin`.
+
+    Returns a lazy queryset of primary keys (ordered by pk), restricted to
+    `queryset`, so no pk is loaded into memory until it's iterated.
+    """
+    changelist_request = copy.copy(request)
+    changelist_request.GET = decode_query_selection(selection)
+    changelist = model_admin.get_changelist_instance(changelist_request)
+    matching = changelist.get_queryset(changelist_request)
+    return queryset.filter(
+        pk__in=matching.values('pk')).order_by('pk').values_list('pk', flat=True)
+
+
+def iter_pk_chunks(object_ids, chunk_size):
+    """
+    Yields lists of at most `chunk_size` pks.
+
+    `chunk_size` may also be a callable, asked for the size of every chunk.
+    Lazy (queryset) selections are paginated by pk, so only one chunk is held
+    in memory at a time.
+    """
+    get_size = chunk_size if callable(chunk_size) else lambda: chunk_size
+    if isinstance(object_ids, QuerySet):
+        last_pk = None
+        while True:
+            chunk_queryset = object_ids
+            if last_pk is not None:
+                chunk_queryset = chunk_queryset.filter(pk__gt=last_pk)
+            chunk = list(chunk_queryset.order_by('pk')[:get_size()])
+            if not chunk:
+                return
+            yield chunk
+            last_pk = chunk[-1]
+    else:
+        i = 0
+        while i < len(object_ids):
+            size = get_size()
+            yield object_ids[i: i + size]
+            i += size
+
+
+def get_pk_filter(pks):
+    """
+    Filter matching `pks`. Runs of consecutive integer pks are matched with
+    BETWEEN instead of listing every pk as a bound parameter.
+    """
+    if not pks or not all(type(pk) is int for pk in pks):
+        return Q(pk__in=pks)
+    pk_filter = Q()
+    singles = []
+    for start, end in iter_runs(sorted(pks)):
+        if end - start + 1 >= MIN_RANGE_LENGTH:
+            pk_filter |= Q(pk__range=(start, end))
+        else:
+            singles.extend(range(start, end + 1))
+    if singles:
+        pk_filter |= Q(pk__in=singles)
+    return pk_filter
+
+
+def iter_pk_filters(object_ids, chunk_size):
+    """
+    Yields (filter, number of pks) for every chunk of the selection.
+
+    Lazy (queryset) selections are not loaded at all: each chunk is a window
+    of pks, its upper bound found with one query, combined with the
+    selection's own filter, so the database works out which rows match.
+    """
+    get_size = chunk_size if callable(chunk_size) else lambda: chunk_size
+    if not isinstance(object_ids, QuerySet):
+        for chunk in iter_pk_chunks(object_ids, get_size):
+            yield get_pk_filter(chunk), len(chunk)
+        return
+
+    after = Q()
+    while True:
+        size = get_size()
+        upper = list(object_ids.filter(after).order_by('pk')[size - 1: size])
+        if not upper:
+            # last window, whatever is left of the selection
+            yield Q(pk__in=object_ids) & after, 0
+            return
+        yield Q(pk__in=object_ids) & after & Q(pk__lte=upper[0]), size
+        after = Q(pk__gt=upper[0])
+
+
+def count_selection(queryset, object_ids, chunk_size, max_missing):
+    """
+    Returns (number of selected objects found in `queryset`, number of
+    selected pks, first `max_missing` pks that were not found).
+
+    Each chunk costs one COUNT query, pks are only loaded for chunks where
+    objects are missing. Lazy (queryset) selections are taken from
+    `queryset`, so nothing can be missing from them.
+    """
+    if isinstance(object_ids, QuerySet):
+        count = object_ids.count()
+        return count, count, []
+
+    found_count, missing = 0, []
+    for chunk in iter_pk_chunks(object_ids, chunk_size):
+        chunk_queryset = queryset.filter(get_pk_filter(chunk))
+        chunk_count = chunk_queryset.count()
+        found_count += chunk_count
+        if chunk_count < len(chunk) and len(missing) < max_missing:
+            found = {str(pk) for pk in chunk_queryset.values_list('pk', flat=True)}
+            missing.extend(pk for pk in chunk if str(pk) not in found)
+    return found_count, len(object_ids), missing[:max_missing]
+
+
+def is_select_across(request):
+    """Whether the user chose "select all N" on the changelist"""
+    return forms.BooleanField(required=False).clean(request.POST.get('select_across'))
+
+
+def get_redirect_url(url_name, model_meta, token):
+    return reverse(
+        url_name,
+        kwargs={"app_name": model_meta.app_label,
+                "model_name": model_meta.model_name,
+                "object_ids": token})
+
+
+def get_action_redirect_url(url_name, modeladmin, request, queryset):
+    """Mass change url for the objects chosen with an admin action"""
+    if is_select_across(request):
+        token = get_query_token(request.GET.urlencode(), request.session)
+    else:
+        token = get_pk_list_token(queryset.values_list('pk', flat=True), request.session)
+
+    redirect_url = get_redirect_url(url_name, modeladmin.model._meta, token)
+    return add_preserved_filters(
+        {'preserved_filters': modeladmin.get_preserved_filters(request),
+         'opts': queryset.model._meta},
+        redirect_url)
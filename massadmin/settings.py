@@ -4,6 +4,20 @@ from django.conf import settings
 _default_settings = {
     'ADD_ACTION_GLOBALLY': True,
     'SESSION_BASED_URL_THRESHOLD': 500,
+    'CHUNK_SIZE': 500,
+    'LOG_MODE': 'bulk',
+    'UPDATE_CHUNK_SIZE': 500,
+    'ADAPTIVE_CHUNK_SIZE': False,
+    'UPDATE_TARGET_SECONDS': 0.5,
+    'JOB_MODE': False,
+    'JOB_CHUNK_SIZE': 500,
+    'SELECTION_STORE': 'massadmin.stores.DatabaseSelectionStore',
+    'SELECTION_TTL': 60 * 60 * 24,
+    'SELECTION_MAX_ENTRIES': 10000,
+    'SELECTION_CACHE': 'default',
+    'LARGE_RELATION_THRESHOLD': 1000,
+    'SKIP_UNCHANGED': False,
+    'MAX_PK_SET_SIZE': 10000000,
 }
 
 _settings = getattr(settings, 'MASSEDIT', _default_settings)
@@ -15,3 +29,17 @@ def _get_value(name):
 
 ADD_ACTION_GLOBALLY = _get_value('ADD_ACTION_GLOBALLY')
 SESSION_BASED_URL_THRESHOLD = _get_value('SESSION_BASED_URL_THRESHOLD')
+CHUNK_SIZE = _get_value('CHUNK_SIZE')
+LOG_MODE = _get_value('LOG_MODE')
+UPDATE_CHUNK_SIZE = _get_value('UPDATE_CHUNK_SIZE')
+ADAPTIVE_CHUNK_SIZE = _get_value('ADAPTIVE_CHUNK_SIZE')
+UPDATE_TARGET_SECONDS = _get_value('UPDATE_TARGET_SECONDS')
+JOB_MODE = _get_value('JOB_MODE')
+JOB_CHUNK_SIZE = _get_value('JOB_CHUNK_SIZE')
+SELECTION_STORE = _get_value('SELECTION_STORE')
+SELECTION_TTL = _get_value('SELECTION_TTL')
+SELECTION_MAX_ENTRIES = _get_value('SELECTION_MAX_ENTRIES')
+SELECTION_CACHE = _get_value('SELECTION_CACHE')
+LARGE_RELATION_THRESHOLD = _get_value('LARGE_RELATION_THRESHOLD')
+SKIP_UNCHANGED = _get_value('SKIP_UNCHANGED')
+MAX_PK_SET_SIZE = _get_value('MAX_PK_SET_SIZE')
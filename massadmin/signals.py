@@ -0,0 +1,28 @@
+"""
+Signals of the bulk engine.
+
+``queryset.update()`` doesn't send ``pre_save``/``post_save``. Instead, the
+bulk engine (``MassAdminImproved`` and bulk jobs) sends these signals once
+per chunk, so receivers can do their own set based work (reindexing,
+cache invalidation...) for the whole chunk at once. Arguments:
+
+``sender``
+    The edited model class.
+``pks``
+    List of the primary keys of the chunk.
+``fields``
+    Names of the edited fields.
+``values``
+    ``{field name: value}``, as given to ``update()``; many-to-many fields
+    are lists of related primary keys.
+``using``
+    The database alias.
+"""
+from django.dispatch import Signal
+
+mass_pre_update = Signal()
+mass_post_update = Signal()
+
+
+def has_mass_update_receivers(model):
+    return mass_pre_update.has_listeners(model) or mass_post_update.has_listeners(model)
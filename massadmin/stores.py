@@ -0,0 +1,135 @@
+"""
+Storage of selections too long to be kept in the mass change url.
+
+The url then contains a token, made of the store prefix and a hash of the
+selection, and the selection itself is kept in the configured store
+(``MASSEDIT['SELECTION_STORE']``) for ``MASSEDIT['SELECTION_TTL']`` seconds.
+"""
+import hashlib
+from datetime import timedelta
+
+from django.core.cache import caches
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import settings
+
+_store = None
+
+
+def get_selection_store():
+    """The store configured in settings, instantiated once"""
+    global _store
+    if _store is None:
+        _store = import_string(settings.SELECTION_STORE)()
+    return _store
+
+
+class BaseSelectionStore:
+    prefix = None
+
+    def get_token(self, selection):
+        return self.prefix + hashlib.md5(selection.encode('utf-8')).hexdigest()
+
+    def owns(self, token):
+        return token.startswith(self.prefix)
+
+    def save(self, selection, session):
+        """Stores `selection` and returns the token to put in the url"""
+        raise NotImplementedError
+
+    def load(self, token, session):
+        """Returns the selection stored under `token`, None if it expired"""
+        raise NotImplementedError
+
+    def cleanup(self):
+        """Removes expired selections, returns how many were removed"""
+        return 0
+
+
+class SessionSelectionStore(BaseSelectionStore):
+    """
+    Keeps selections in the user's session.
+
+    Entries never expire and live as long as the session does.
+    """
+    prefix = "session-"
+
+    def save(self, selection, session):
+        token = self.get_token(selection)
+        session[token] = selection
+        session.save()
+        return token
+
+    def load(self, token, session):
+        return session.get(token)
+
+
+class CacheSelectionStore(BaseSelectionStore):
+    """
+    Keeps selections in the cache named by ``MASSEDIT['SELECTION_CACHE']``.
+
+    Expiration and eviction are left to the cache backend. The backend has to
+    be shared between processes (memcached, redis, database...).
+    """
+    prefix = "cache-"
+    key_prefix = "massadmin:selection:"
+
+    @property
+    def cache(self):
+        return caches[settings.SELECTION_CACHE]
+
+    def save(self, selection, session):
+        token = self.get_token(selection)
+        self.cache.set(self.key_prefix + token, selection, settings.SELECTION_TTL)
+        return token
+
+    def load(self, token, session):
+        return self.cache.get(self.key_prefix + token)
+
+
+class DatabaseSelectionStore(BaseSelectionStore):
+    """
+    Keeps selections in the ``MassEditSelection`` table.
+
+    Expired rows are ignored and deleted by ``cleanup``, which also evicts the
+    oldest rows beyond ``MASSEDIT['SELECTION_MAX_ENTRIES']``.
+    """
+    prefix = "sel-"
+
+    def save(self, selection, session):
+        from .models import MassEditSelection
+
+        token = self.get_token(selection)
+        MassEditSelection.objects.update_or_create(
+            token=token,
+            defaults={
+                'selection': selection,
+                'expires_at': timezone.now() + timedelta(seconds=settings.SELECTION_TTL),
+            })
+        return token
+
+    def load(self, token, session):
+        from .models import MassEditSelection
+
+        return MassEditSelection.objects.filter(
+            token=token,
+            expires_at__gt=timezone.now(),
+        ).values_list('selection', flat=True).first()
+
+    def cleanup(self):
+        from .models import MassEditSelection
+
+        removed, _ = MassEditSelection.objects.filter(expires_at__lte=timezone.now()).delete()
+        max_entries = settings.SELECTION_MAX_ENTRIES
+        if max_entries:
+            # newest entry that is still kept, everything older is evicted
+            cutoff = MassEditSelection.objects.order_by('-expires_at', '-pk').values_list(
+                'expires_at', 'pk')[max_entries - 1: max_entries].first()
+            if cutoff is not None:
+                expires_at, pk = cutoff
+                evicted, _ = MassEditSelection.objects.filter(
+                    Q(expires_at__lt=expires_at) | Q(expires_at=expires_at, pk__lt=pk)).delete()
+                removed += evicted
+        return removed
@@ -1,6 +1,7 @@
 from django.urls import path
-from .massadmin import mass_change_view
+from .massadmin import mass_change_view, mass_edit_job_status
 from .massadmin_improved import mass_change_view as improved_mass_admin_view
+from .massadmin_auto import mass_change_view as auto_mass_admin_view
 
 
 urlpatterns = [
@@ -14,4 +15,14 @@ urlpatterns = [
         improved_mass_admin_view,
         name='improved_massadmin_change_view',
     ),
+    path(
+        '<str:app_name>/<str:model_name>-auto_masschange/<str:object_ids>/',
+        auto_mass_admin_view,
+        name='auto_massadmin_change_view',
+    ),
+    path(
+        'massadmin-jobs/<int:job_id>/',
+        mass_edit_job_status,
+        name='massadmin_job_status',
+    ),
 ]
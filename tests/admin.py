@@ -7,6 +7,9 @@ from .models import (
     CustomAdminModel2,
     InheritedAdminModel,
     FieldsetsAdminModel,
+    TagModel,
+    TaggedAdminModel,
+    ProductModel,
 )
 
 
@@ -67,6 +70,15 @@ class InheritedAdmin(BaseAdmin):
 
 
 admin.site.register(InheritedAdminModel, InheritedAdmin)
+admin.site.register(TagModel)
+admin.site.register(TaggedAdminModel)
+
+
+class ProductAdmin(admin.ModelAdmin):
+    pass
+
+
+admin.site.register(ProductModel, ProductAdmin)
 
 custom_admin_site = admin.AdminSite(name='myadmin')
 custom_admin_site.register(CustomAdminModel, CustomAdmin)
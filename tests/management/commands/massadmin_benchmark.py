@@ -0,0 +1,246 @@
+"""
+Benchmark of the mass edit engines on the models of the tests app.
+
+    python manage.py massadmin_benchmark --settings=tests.settings --output results.json
+
+For every scenario and selection size, the mass change form of each engine
+is posted through the test client, recording wall time, number of queries
+and peak Python memory (tracemalloc, which slows Python code down: compare
+runs made with the same options). The time each request spends getting its
+mass admin object is measured too, built with for_model() and taken from
+the cache of massadmin.cache. Results are written as JSON.
+"""
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import django
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from massadmin import massadmin, massadmin_improved
+from massadmin.cache import get_mass_admin
+
+from ...models import CustomAdminModel, InheritedAdminModel
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+SEED_BATCH_SIZE = 1000
+
+ENGINES = {
+    'classic': massadmin.get_mass_change_redirect_url,
+    'bulk': massadmin_improved.get_mass_change_redirect_url,
+}
+
+ENGINE_CLASSES = {
+    'classic': massadmin.MassAdmin,
+    'bulk': massadmin_improved.MassAdminImproved,
+}
+DEFAULT_SETUP_RUNS = 2000
+
+
+class QueryCounter:
+    """Database execute wrapper counting queries"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def seed_custom(size):
+    """CustomAdminModel objects, each with an inline InheritedAdminModel"""
+    missing = size - CustomAdminModel.objects.count()
+    for start in range(0, max(missing, 0), SEED_BATCH_SIZE):
+        parents = CustomAdminModel.objects.bulk_create([
+            CustomAdminModel(name='seed') for i in range(min(SEED_BATCH_SIZE, missing - start))])
+        if not all(parent.pk for parent in parents):
+            # backends not returning pks from bulk_create
+            parents = CustomAdminModel.objects.order_by('-pk')[:len(parents)]
+        InheritedAdminModel.objects.bulk_create([
+            InheritedAdminModel(name='child', fk_field=parent) for parent in parents])
+    return CustomAdminModel.objects.order_by('pk'), {'_mass_change': 'name', 'name': 'renamed'}
+
+
+def seed_inherited(size):
+    """InheritedAdminModel objects, their foreign key being edited"""
+    queryset, data = seed_custom(size)
+    target = queryset.first()
+    return (InheritedAdminModel.objects.order_by('pk'),
+            {'_mass_change': 'fk_field', 'fk_field': str(target.pk)})
+
+
+INLINE_PREFIX = 'inheritedadminmodel_set'
+
+
+def seed_inline_formset(size):
+    """CustomAdminModel objects, each getting a new child from the inline formset"""
+    queryset, data = seed_custom(size)
+    return queryset, dict(data, **{
+        '_mass_change': ['name', INLINE_PREFIX],
+        INLINE_PREFIX + '-TOTAL_FORMS': '1',
+        INLINE_PREFIX + '-INITIAL_FORMS': '0',
+        INLINE_PREFIX + '-MIN_NUM_FORMS': '0',
+        INLINE_PREFIX + '-MAX_NUM_FORMS': '1000',
+        INLINE_PREFIX + '-0-name': 'added',
+    })
+
+
+def seed_bulk_inline(size):
+    """
+    The inline formset posted as a bulk inline: the new child is added to all
+    objects at once, then the children of all objects are renamed.
+    """
+    queryset, data = seed_inline_formset(size)
+    return queryset, dict(data, **{
+        '_bulk_inline': INLINE_PREFIX,
+        '_bulk_inline_update_' + INLINE_PREFIX: 'name',
+        INLINE_PREFIX + '-__all__-name': 'renamed',
+    })
+
+
+SCENARIOS = {
+    'custom_with_inlines': seed_custom,
+    'inherited_with_fk': seed_inherited,
+    'inline_formset': seed_inline_formset,
+    'bulk_inline': seed_bulk_inline,
+}
+
+# the bulk engine only edits bulk inlines, other scenarios run with every engine
+SCENARIO_ENGINES = {
+    'inline_formset': ('classic',),
+}
+
+
+@contextmanager
+def measure(result, memory):
+    counter = QueryCounter()
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        with connection.execute_wrapper(counter):
+            yield
+    finally:
+        result['seconds'] = round(time.perf_counter() - started, 4)
+        result['queries'] = counter.count
+        if memory:
+            result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+
+def measure_setup(mass_admin_class, model, runs):
+    """Microseconds per request spent getting the mass admin object of `model`"""
+    started = time.perf_counter()
+    for i in range(runs):
+        mass_admin_class.for_model(model, admin.site)
+    built = time.perf_counter() - started
+
+    get_mass_admin(mass_admin_class, admin.site, model)
+    started = time.perf_counter()
+    for i in range(runs):
+        get_mass_admin(mass_admin_class, admin.site, model)
+    cached = time.perf_counter() - started
+    return {
+        'model': model._meta.label,
+        'runs': runs,
+        'built_us': round(built / runs * 1e6, 2),
+        'cached_us': round(cached / runs * 1e6, 2),
+    }
+
+
+class Command(BaseCommand):
+    help = "Measures mass edits of both engines on seeded tests models"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+            help="Numbers of selected objects.")
+        parser.add_argument(
+            '--engines', nargs='+', choices=sorted(ENGINES), default=sorted(ENGINES),
+            help="Engines to measure.")
+        parser.add_argument(
+            '--scenarios', nargs='+', choices=sorted(SCENARIOS), default=sorted(SCENARIOS),
+            help="Seeded models and edited fields.")
+        parser.add_argument(
+            '--no-memory', action='store_false', dest='memory',
+            help="Don't trace memory allocations.")
+        parser.add_argument(
+            '--no-test-db', action='store_false', dest='test_db',
+            help="Use the configured database instead of creating a test database.")
+        parser.add_argument(
+            '--setup-runs', type=int, default=DEFAULT_SETUP_RUNS,
+            help="Times the mass admin object is got to measure its setup, 0 to skip it.")
+        parser.add_argument(
+            '--output', default=None,
+            help="File the JSON results are written to, standard output by default.")
+
+    def handle(self, *args, **options):
+        if options['test_db']:
+            setup_test_environment()
+            old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            results = self.run(options)
+            setup = self.run_setup(options)
+        finally:
+            if options['test_db']:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+        report = json.dumps({
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'results': results,
+            'setup': setup,
+        }, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report)
+        else:
+            self.stdout.write(report)
+
+    def run(self, options):
+        user = User.objects.filter(username='massadmin_benchmark').first()
+        if user is None:
+            user = User.objects.create_superuser(
+                'massadmin_benchmark', 'massadmin_benchmark@example.com', None)
+        client = Client()
+        client.force_login(user)
+
+        results = []
+        for scenario in options['scenarios']:
+            for size in sorted(options['sizes']):
+                queryset, data = SCENARIOS[scenario](size)
+                pks = list(queryset.values_list('pk', flat=True)[:size])
+                for engine in options['engines']:
+                    if engine not in SCENARIO_ENGINES.get(scenario, ENGINES):
+                        continue
+                    session = client.session
+                    url = ENGINES[engine](queryset.model._meta, pks, session)
+                    session.save()
+                    result = {'scenario': scenario, 'engine': engine, 'rows': len(pks)}
+                    with measure(result, options['memory']):
+                        response = client.post(url, data)
+                    result['status_code'] = response.status_code
+                    results.append(result)
+                    self.stderr.write('%(scenario)s %(engine)s %(rows)s rows: %(seconds)ss, '
+                                      '%(queries)s queries' % result)
+        return results
+
+    def run_setup(self, options):
+        results = []
+        if options['setup_runs'] <= 0:
+            return results
+        for engine in options['engines']:
+            result = dict(measure_setup(
+                ENGINE_CLASSES[engine], User, options['setup_runs']), engine=engine)
+            results.append(result)
+            self.stderr.write('%(engine)s mass admin of %(model)s: %(built_us)sus built, '
+                              '%(cached_us)sus cached' % result)
+        return results
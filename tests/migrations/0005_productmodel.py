@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tests', '0004_tagmodel_taggedadminmodel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64)),
+                ('price', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('stock', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
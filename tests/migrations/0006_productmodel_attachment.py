@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tests', '0005_productmodel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productmodel',
+            name='attachment',
+            field=models.FileField(blank=True, upload_to='attachments'),
+        ),
+    ]
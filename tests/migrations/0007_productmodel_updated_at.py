@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tests', '0006_productmodel_attachment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productmodel',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+    ]
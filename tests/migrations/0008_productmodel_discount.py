@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tests', '0007_productmodel_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productmodel',
+            name='discount',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -31,3 +31,33 @@ class InheritedAdminModel(models.Model):
 
     class Meta:
         app_label = "tests"
+
+
+class TagModel(models.Model):
+    name = models.CharField(max_length=32)
+
+    class Meta:
+        app_label = "tests"
+
+    def __str__(self):
+        return self.name
+
+
+class TaggedAdminModel(models.Model):
+    name = models.CharField(max_length=32)
+    tags = models.ManyToManyField(TagModel, blank=True)
+
+    class Meta:
+        app_label = "tests"
+
+
+class ProductModel(models.Model):
+    name = models.CharField(max_length=64)
+    price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    stock = models.IntegerField(default=0)
+    discount = models.IntegerField(null=True, blank=True)
+    attachment = models.FileField(upload_to="attachments", blank=True)
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+
+    class Meta:
+        app_label = "tests"
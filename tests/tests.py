@@ -1,23 +1,64 @@
+import csv
+import json
+from io import StringIO
+import os
+import random
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from array import array
+
 from six.moves.urllib import parse
-from django.contrib.auth.models import User
+from unittest import mock
+from django.contrib.admin.models import CHANGE, LogEntry
+from django.contrib.auth.models import Permission, User
+from django.core.management import call_command
+from django.utils import timezone
 from django.contrib import admin
+from django.db import connection
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_save
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase, override_settings, RequestFactory
+from django.test.utils import CaptureQueriesContext
 try:
     from django.urls import reverse
 except ImportError:  # Django<2.0
     from django.core.urlresolvers import reverse
+from massadmin import selection
+from massadmin import settings as massadmin_settings
 from massadmin.massadmin import MassAdmin, get_mass_change_redirect_url
+from massadmin import cache as metadata_cache
+from massadmin import massadmin as massadmin_module
+from massadmin import csv_update
+from massadmin import instrumentation
+from massadmin.engines import ENGINE_BULK, ENGINE_CLASSIC, select_engine
+from massadmin.chunking import AdaptiveChunkSizer, get_max_chunk_size, get_update_chunk_sizer
+from massadmin.m2m import M2M_ADD, bulk_set_m2m
+from massadmin.jobs import claim_next_job, enqueue_job
+from massadmin.models import MassEditJob, MassEditSelection
+from massadmin.massadmin_auto import (
+    get_mass_change_redirect_url as auto_get_mass_change_redirect_url,
+)
+from massadmin.signals import mass_post_update, mass_pre_update
+from massadmin.stores import CacheSelectionStore, SessionSelectionStore
 from massadmin.massadmin_improved import (
     MassAdminImproved,
-    get_mass_change_redirect_url as improved_get_mass_change_redirect_url
+    get_mass_change_redirect_url as improved_get_mass_change_redirect_url,
+    mass_change_selected as improved_mass_change_selected,
 )
 
-from .admin import CustomAdminForm, BaseAdmin, InheritedAdmin
+from .admin import CustomAdminForm, CustomAdmin, BaseAdmin, InheritedAdmin, ProductAdmin
 from .models import (
     CustomAdminModel,
     CustomAdminModel2,
     InheritedAdminModel,
     FieldsetsAdminModel,
+    TagModel,
+    TaggedAdminModel,
+    ProductModel,
 )
 from .site import CustomAdminSite
 from .mocks import MockRenderMassAdmin
@@ -334,3 +375,1637 @@ class ImprovedCustomizationTestCase(TestCase):
         render_args = mock_ma.mass_change_view(request, str(model.pk))
         self.assertTrue('custom_variable' in render_args['context'])
         self.assertEqual(render_args['context']['custom_variable'], 'custom_value')
+
+
+@mock.patch.object(CustomAdmin, "massadmin_job_mode", True, create=True)
+@mock.patch.object(ProductAdmin, "massadmin_job_mode", True, create=True)
+class JobModeTest(TestCase):
+    """ Edits are queued and applied later by the massadmin_worker command """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+        self.models = [ProductModel.objects.create(name="product {}".format(i))
+                       for i in range(0, 3)]
+
+    def assertNames(self, names, model=ProductModel):
+        new_names = model.objects.order_by("pk").values_list("name", flat=True)
+        self.assertEqual(list(new_names), names)
+
+    def test_post_queues_job(self):
+        response = self.client.post(get_massadmin_url(self.models, self.client.session),
+                                    {"_mass_change": "name",
+                                     "name": "new name"})
+        self.assertRedirects(response, get_changelist_url(ProductModel))
+        # nothing is changed until the worker runs
+        self.assertNames([m.name for m in self.models])
+
+        job = MassEditJob.objects.get()
+        self.assertEqual(job.status, MassEditJob.STATUS_PENDING)
+        self.assertEqual(job.engine, MassEditJob.ENGINE_CLASSIC)
+        self.assertEqual(job.total_count, 3)
+        self.assertEqual(job.user, self.user)
+
+        call_command("massadmin_worker", once=True, stdout=mock.MagicMock())
+
+        self.assertNames(["new name"] * 3)
+        job.refresh_from_db()
+        self.assertEqual(job.status, MassEditJob.STATUS_DONE)
+        self.assertEqual(job.processed_count, 3)
+        self.assertEqual(job.changed_count, 3)
+        self.assertEqual(job.error_count, 0)
+
+    def test_stale_running_job_is_resumed(self):
+        self.client.post(get_massadmin_url(self.models, self.client.session),
+                         {"_mass_change": "name", "name": "new name"})
+        job = claim_next_job()
+        # the worker died after the first chunk of one object
+        MassEditJob.objects.filter(pk=job.pk).update(processed_count=1, changed_count=1)
+
+        call_command("massadmin_worker", once=True, stdout=mock.MagicMock())
+        job.refresh_from_db()
+        self.assertEqual(job.status, MassEditJob.STATUS_RUNNING)
+
+        MassEditJob.objects.filter(pk=job.pk).update(
+            updated_at=timezone.now() - timedelta(hours=2))
+        call_command("massadmin_worker", once=True, stdout=mock.MagicMock())
+        job.refresh_from_db()
+        self.assertEqual(job.status, MassEditJob.STATUS_DONE)
+        self.assertEqual(job.changed_count, 3)
+        self.assertNames(["product 0", "new name", "new name"])
+
+    def test_improved_post_queues_bulk_job(self):
+        models = [CustomAdminModel.objects.create(name="model {}".format(i))
+                  for i in range(0, 3)]
+        response = self.client.post(
+            improved_get_massadmin_url(models, self.client.session),
+            {"_mass_change": "name", "name": "new name"})
+        self.assertRedirects(response, get_changelist_url(CustomAdminModel))
+        job = MassEditJob.objects.get()
+        self.assertEqual(job.engine, MassEditJob.ENGINE_BULK)
+
+        call_command("massadmin_worker", once=True, chunk_size=2, stdout=mock.MagicMock())
+
+        self.assertNames(["new name"] * 3, CustomAdminModel)
+        job.refresh_from_db()
+        self.assertEqual(job.status, MassEditJob.STATUS_DONE)
+        self.assertEqual(job.changed_count, 3)
+
+    def test_per_object_validation_is_not_queued(self):
+        # clean_name() depends on the edited object, jobs validate the first one only
+        models = [CustomAdminModel.objects.create(name="model {}".format(i))
+                  for i in range(0, 3)]
+        response = self.client.post(get_massadmin_url(models, self.client.session),
+                                    {"_mass_change": "name", "name": "new name"})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(MassEditJob.objects.exists())
+        self.assertNames(["new name"] * 3, CustomAdminModel)
+
+    def test_admin_save_model_is_not_queued(self):
+        def save_model(self, request, obj, form, change):
+            obj.save()
+
+        with mock.patch.object(ProductAdmin, "save_model", save_model, create=True):
+            self.client.post(get_massadmin_url(self.models, self.client.session),
+                             {"_mass_change": "name", "name": "new name"})
+        self.assertFalse(MassEditJob.objects.exists())
+        self.assertNames(["new name"] * 3)
+
+    def test_file_field_is_not_queued(self):
+        # without an upload, the form's value is the first object's file
+        response = self.client.post(get_massadmin_url(self.models, self.client.session),
+                                    {"_mass_change": ["stock", "attachment"], "stock": "3"})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(MassEditJob.objects.exists())
+        self.assertEqual(list(ProductModel.objects.values_list("stock", flat=True)), [3, 3, 3])
+
+    def test_inline_is_not_queued(self):
+        # an inline whose foreign key has related_name="inheritedadminmodel"
+        # has the name of the reverse relation as prefix
+        request = RequestFactory().post("/")
+        request.user = self.user
+        ma = MassAdminImproved.for_model(CustomAdminModel, admin.site)
+        ModelForm = ma.get_form(request)
+        self.assertTrue(ma.use_job_mode(request, ModelForm, ["name"]))
+        self.assertFalse(ma.use_job_mode(request, ModelForm, ["name", "inheritedadminmodel"]))
+
+    def test_invalid_form_is_not_queued(self):
+        response = self.client.post(get_massadmin_url(self.models, self.client.session),
+                                    {"_mass_change": "stock",
+                                     "stock": "many"})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'errornote')
+        self.assertFalse(MassEditJob.objects.exists())
+
+    def test_job_status(self):
+        self.client.post(get_massadmin_url(self.models, self.client.session),
+                         {"_mass_change": "name", "name": "new name"})
+        job = MassEditJob.objects.get()
+        url = reverse("massadmin_job_status", kwargs={"job_id": job.pk})
+
+        status = json.loads(self.client.get(url).content)
+        self.assertEqual(status["status"], MassEditJob.STATUS_PENDING)
+        self.assertEqual(status["processed"], 0)
+
+        call_command("massadmin_worker", once=True, stdout=mock.MagicMock())
+        status = json.loads(self.client.get(url).content)
+        self.assertEqual(status["status"], MassEditJob.STATUS_DONE)
+        self.assertEqual(status["changed"], 3)
+        self.assertEqual(status["total"], 3)
+
+    def test_job_status_of_other_user(self):
+        job = MassEditJob.objects.create(
+            app_label="tests", model_name="customadminmodel", object_ids="1", values="{}",
+            user=self.user)
+        User.objects.create_user('staff', 'staff@gmail.com', 'staff', is_staff=True)
+        self.client.login(username='staff', password='staff')
+        url = reverse("massadmin_job_status", kwargs={"job_id": job.pk})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+def visible_products(self, request):
+    return ProductModel.objects.exclude(name="hidden")
+
+
+@mock.patch.object(ProductAdmin, "massadmin_job_mode", True, create=True)
+class JobQuerysetTest(TestCase):
+    """ Jobs only edit the objects of the admin's queryset """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+        self.products = [ProductModel.objects.create(name=name)
+                         for name in ("product", "hidden", "product")]
+
+    @mock.patch.object(ProductAdmin, "massadmin_queryset", visible_products, create=True)
+    def test_hidden_objects_are_not_queued(self):
+        response = self.client.post(
+            get_massadmin_url(self.products, self.client.session),
+            {"_mass_change": "stock", "stock": "5"}, follow=True)
+        messages = [str(message) for message in response.context["messages"]]
+        self.assertIn("1 selected product models were not queued: they don't exist or "
+                      "you can't change them.", messages)
+        job = MassEditJob.objects.get()
+        self.assertEqual(job.total_count, 2)
+
+        call_command("massadmin_worker", once=True, stdout=mock.MagicMock())
+        self.assertEqual(list(ProductModel.objects.order_by("pk").values_list("stock", flat=True)),
+                         [5, 0, 5])
+
+    @mock.patch.object(massadmin_settings, "CHUNK_SIZE", 2)
+    def test_selection_is_streamed(self):
+        pks = [p.pk for p in self.products]
+        visible = ProductModel.objects.exclude(name="hidden")
+        lazy_selection = ProductModel.objects.values_list("pk", flat=True)
+        with mock.patch("massadmin.selection.iter_pk_chunks",
+                        side_effect=selection.iter_pk_chunks) as iter_pk_chunks:
+            job = enqueue_job(ProductModel, lazy_selection, {"stock": 5}, queryset=visible)
+        iter_pk_chunks.assert_called_once_with(mock.ANY, 2)
+        self.assertEqual(job.total_count, 2)
+        self.assertEqual(list(selection.parse_pk_list(job.object_ids)), [pks[0], pks[2]])
+
+        job = enqueue_job(ProductModel, [str(pk) for pk in pks[::-1]] + [str(pks[0])],
+                          {"stock": 5}, queryset=visible)
+        self.assertEqual(job.total_count, 2)
+        self.assertEqual(list(selection.parse_pk_list(job.object_ids)), [pks[0], pks[2]])
+
+
+class SelectAcrossTest(TestCase):
+    """ "Select all" stores the changelist query instead of every pk """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+        for i in range(0, 4):
+            CustomAdminModel.objects.create(name="aaa {}".format(i))
+            CustomAdminModel.objects.create(name="bbb {}".format(i))
+
+    def get_mass_change_url(self, query="name__startswith=a"):
+        changelist_url = get_changelist_url(CustomAdminModel) + "?" + query
+        first = CustomAdminModel.objects.filter(name__startswith="a").first()
+        response = self.client.post(changelist_url,
+                                    {"action": "mass_change_selected",
+                                     "select_across": "1",
+                                     "_selected_action": first.pk})
+        self.assertEqual(response.status_code, 302)
+        return response.get("Location")
+
+    def assertEdited(self, url):
+        # the query is evaluated when the edit runs
+        CustomAdminModel.objects.create(name="aaa late")
+        response = self.client.post(url, {"_mass_change": "name", "name": "new name"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(CustomAdminModel.objects.filter(name="new name").count(), 5)
+        self.assertEqual(CustomAdminModel.objects.filter(name__startswith="b").count(), 4)
+
+    def test_url_contains_query_instead_of_pks(self):
+        url = self.get_mass_change_url()
+        self.assertIn("/query-", url)
+        response = self.client.get(url)
+        self.assertContains(response, 'Change custom admin model')
+
+    def test_update(self):
+        self.assertEdited(self.get_mass_change_url())
+
+    def test_update_with_search(self):
+        with mock.patch.object(CustomAdmin, "search_fields", ("name", ), create=True):
+            self.assertEdited(self.get_mass_change_url("q=aaa"))
+
+    @mock.patch.object(CustomAdmin, "actions", (improved_mass_change_selected, ))
+    def test_improved_update(self):
+        url = self.get_mass_change_url()
+        self.assertIn("-improved_masschange/query-", url)
+        self.assertEdited(url)
+
+    def test_invalid_query(self):
+        for params in ("nosuch__field=1", "name__nosuchlookup=1"):
+            url = reverse("massadmin_change_view", kwargs={
+                "app_name": "tests",
+                "model_name": "customadminmodel",
+                "object_ids": selection.get_query_token(params, self.client.session)})
+            self.assertEqual(self.client.get(url).status_code, 404)
+            self.assertEqual(self.client.post(url, {"_mass_change": "name",
+                                                    "name": "new name"}).status_code, 404)
+
+
+class PkSetEncodingTest(TestCase):
+    """ Integer pk selections are stored as compact pk sets """
+
+    def assertRoundTrip(self, pks):
+        token = selection.encode_pk_set(pks)
+        self.assertTrue(token.startswith(selection.PK_SET_PREFIX))
+        self.assertEqual(list(selection.decode_pk_set(token)), sorted(set(pks)))
+        return token
+
+    def test_round_trip(self):
+        self.assertRoundTrip([1])
+        self.assertRoundTrip([5, 3, 4, 3, 10, 12, 11, 200000])
+        self.assertRoundTrip([-3, -2, 0, 7])
+        self.assertRoundTrip(list(range(1, 1000, 3)))
+        self.assertRoundTrip([])
+
+    def test_dense_ranges_are_small(self):
+        token = self.assertRoundTrip(list(range(1, 1200001)))
+        self.assertLess(len(token), 20)
+        token = self.assertRoundTrip(
+            [pk for pk in range(1, 100001) if pk % 1000])
+        self.assertLess(len(token), massadmin_settings.SESSION_BASED_URL_THRESHOLD)
+
+    def test_url_safe(self):
+        token = selection.encode_pk_set(list(range(0, 100000, 7)))
+        self.assertRegex(token, r"^[A-Za-z0-9_-]+$")
+
+    def test_decodes_to_integer_array(self):
+        pks = selection.decode_pk_set(selection.encode_pk_set([1, 2, 3]))
+        self.assertEqual(pks.typecode, 'q')
+
+    def test_other_pks_stay_comma_separated(self):
+        self.assertIsNone(selection.encode_pk_set(["a", "b"]))
+        self.assertEqual(selection.encode_pk_list(["a", "b"]), "a,b")
+        self.assertEqual(selection.parse_pk_list("a,b"), ["a", "b"])
+
+    def test_encode_sorted_pks(self):
+        pks = [1, 2, 3, 7, 9, 10]
+        self.assertEqual(selection.encode_sorted_pks(iter(pks)),
+                         (selection.encode_pk_set(pks), 6))
+        self.assertEqual(selection.encode_sorted_pks(iter(["a", "b"])), ("a,b", 2))
+        self.assertEqual(selection.encode_sorted_pks(iter([])),
+                         (selection.encode_pk_list([]), 0))
+        with self.assertRaises(ValueError):
+            selection.encode_sorted_pks(iter([3, 2]))
+
+    def test_size_is_capped(self):
+        token = selection.encode_pk_set([1, 10 ** 12])
+        with self.assertRaises(ValueError):
+            selection.decode_pk_set(selection.encode_pk_set(list(range(1, 12))), max_size=10)
+        self.assertEqual(len(selection.decode_pk_set(token)), 2)
+        huge = selection._encode_runs([(1, 10 ** 12)])
+        self.assertLess(len(huge), 20)
+        with self.assertRaises(ValueError):
+            selection.decode_pk_set(huge)
+
+    def test_invalid_token(self):
+        for token in ("ids-", "ids-Ag", "ids-AY", "ids-!!"):
+            with self.assertRaises(ValueError):
+                selection.decode_pk_set(token)
+
+
+class PkSetUrlTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+        self.models = [CustomAdminModel.objects.create(name="model {}".format(i))
+                       for i in range(0, 3)]
+
+    def test_url_contains_pk_set(self):
+        url = get_massadmin_url(self.models, self.client.session)
+        self.assertIn("/ids-", url)
+
+    def test_comma_separated_url(self):
+        url = reverse("massadmin_change_view", kwargs={
+            "app_name": "tests",
+            "model_name": "customadminmodel",
+            "object_ids": ",".join(str(m.pk) for m in self.models)})
+        response = self.client.post(url, {"_mass_change": "name", "name": "new name"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(CustomAdminModel.objects.filter(name="new name").count(), 3)
+
+    @mock.patch.object(massadmin_settings, "MAX_PK_SET_SIZE", 2)
+    def test_too_large_pk_set_url(self):
+        self.assertEqual(self.client.get(get_massadmin_url(self.models, self.client.session))
+                         .status_code, 404)
+
+    def test_invalid_pk_set_url(self):
+        url = reverse("massadmin_change_view", kwargs={
+            "app_name": "tests",
+            "model_name": "customadminmodel",
+            "object_ids": "ids-AY"})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class SelectionStoreTest(TestCase):
+    """ Long selections are kept in the selection store, not in the session """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+        CustomAdminModel.objects.bulk_create(
+            [CustomAdminModel(name="model {}".format(i)) for i in range(0, 2000)])
+        # scattered pks, so the pk set doesn't collapse into a few runs
+        self.models = random.Random(0).sample(list(CustomAdminModel.objects.all()), 1000)
+
+    def test_long_selection_uses_store(self):
+        session = self.client.session
+        url = get_massadmin_url(self.models, session)
+        self.assertIn("/sel-", url)
+        self.assertEqual(MassEditSelection.objects.count(), 1)
+        self.assertFalse(any(key.startswith("sel-") for key in session.keys()))
+
+        response = self.client.post(url, {"_mass_change": "name", "name": "new name"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(CustomAdminModel.objects.filter(name="new name").count(), 1000)
+
+    def test_same_selection_same_token(self):
+        url = get_massadmin_url(self.models, self.client.session)
+        self.assertEqual(url, get_massadmin_url(self.models, self.client.session))
+        self.assertEqual(MassEditSelection.objects.count(), 1)
+
+    def test_expired_selection(self):
+        url = get_massadmin_url(self.models, self.client.session)
+        MassEditSelection.objects.update(expires_at=timezone.now())
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_cleanup(self):
+        url = get_massadmin_url(self.models, self.client.session)
+        get_massadmin_url(self.models[:-1], self.client.session)
+        MassEditSelection.objects.exclude(token__in=url.split("/")).update(
+            expires_at=timezone.now())
+
+        call_command("massadmin_cleanup", stdout=mock.MagicMock())
+        self.assertEqual(MassEditSelection.objects.count(), 1)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_cleanup_evicts_oldest(self):
+        for i in range(1, 4):
+            get_massadmin_url(self.models[:-i], self.client.session)
+        newest = MassEditSelection.objects.order_by("-expires_at", "-pk")[:2]
+        newest = set(newest.values_list("pk", flat=True))
+
+        with mock.patch.object(massadmin_settings, "SELECTION_MAX_ENTRIES", 2):
+            call_command("massadmin_cleanup", stdout=mock.MagicMock())
+        self.assertEqual(set(MassEditSelection.objects.values_list("pk", flat=True)), newest)
+
+    def test_legacy_session_url(self):
+        session = self.client.session
+        session["session-legacy"] = ",".join(str(m.pk) for m in self.models)
+        session.save()
+        url = reverse("massadmin_change_view", kwargs={
+            "app_name": "tests",
+            "model_name": "customadminmodel",
+            "object_ids": "session-legacy"})
+        self.assertContains(self.client.get(url), 'Change custom admin model')
+
+    def test_cache_store(self):
+        store = CacheSelectionStore()
+        token = store.save("1,2,3", None)
+        self.assertTrue(token.startswith("cache-"))
+        self.assertEqual(store.load(token, None), "1,2,3")
+
+    def test_session_store(self):
+        session = self.client.session
+        store = SessionSelectionStore()
+        token = store.save("1,2,3", session)
+        self.assertEqual(session[token], "1,2,3")
+        self.assertEqual(store.load(token, session), "1,2,3")
+
+
+class InlineFormsetScalingTest(TestCase):
+    """ Inline formsets are validated and saved once per object """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+
+    def post_with_inline(self, count):
+        models = [CustomAdminModel.objects.create(name="model {}".format(i))
+                  for i in range(0, count)]
+        url = get_massadmin_url(models, self.client.session)
+        data = {
+            "_mass_change": ["name", "inheritedadminmodel_set"],
+            "name": "new name",
+            "inheritedadminmodel_set-TOTAL_FORMS": "1",
+            "inheritedadminmodel_set-INITIAL_FORMS": "0",
+            "inheritedadminmodel_set-MIN_NUM_FORMS": "0",
+            "inheritedadminmodel_set-MAX_NUM_FORMS": "1000",
+            "inheritedadminmodel_set-0-name": "child",
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        return models, len(queries)
+
+    def test_each_object_gets_its_inline(self):
+        with mock.patch.object(MassAdmin, "save_formset", autospec=True,
+                               side_effect=MassAdmin.save_formset) as save_formset:
+            models, _ = self.post_with_inline(5)
+        self.assertEqual(save_formset.call_count, 5)
+        for model in models:
+            self.assertEqual(
+                list(model.inheritedadminmodel_set.values_list("name", flat=True)),
+                ["child"])
+
+    def test_queries_are_linear(self):
+        counts = [self.post_with_inline(count)[1] for count in (2, 4, 6)]
+        self.assertEqual(counts[1] - counts[0], counts[2] - counts[1])
+
+    def test_formset_classes_are_looked_up_once(self):
+        with mock.patch("massadmin.massadmin.get_formsets",
+                        side_effect=massadmin_module.get_formsets) as get_formsets:
+            self.post_with_inline(5)
+        self.assertEqual(get_formsets.call_count, 1)
+
+    def test_unselected_inlines_are_not_built(self):
+        models = [CustomAdminModel.objects.create(name="model {}".format(i))
+                  for i in range(0, 3)]
+        url = get_massadmin_url(models, self.client.session)
+        with mock.patch("massadmin.massadmin.get_formsets") as get_formsets:
+            self.client.get(url)
+            response = self.client.post(url, {"_mass_change": "name", "name": "new name"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(get_formsets.call_count, 0)
+
+
+@mock.patch.object(massadmin_settings, "CHUNK_SIZE", 2)
+class ChunkedEditTest(TestCase):
+    """ The classic engine loads the selected objects chunk by chunk """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+        self.models = [CustomAdminModel.objects.create(name="model {}".format(i))
+                       for i in range(0, 5)]
+
+    def test_iter_selected_objects(self):
+        ma = MassAdmin(CustomAdminModel, admin.site)
+        queryset = CustomAdminModel.objects.all()
+        pks = [m.pk for m in self.models]
+        with self.assertNumQueries(3):
+            objects = list(ma.iter_selected_objects(queryset, pks[::-1]))
+        self.assertCountEqual([o.pk for o in objects], pks)
+
+    def test_iter_selected_objects_of_query_selection(self):
+        ma = MassAdmin(CustomAdminModel, admin.site)
+        queryset = CustomAdminModel.objects.all()
+        object_ids = queryset.exclude(pk=self.models[0].pk).values_list("pk", flat=True)
+        objects = list(ma.iter_selected_objects(queryset, object_ids))
+        self.assertEqual(objects, self.models[1:])
+
+    def test_update(self):
+        response = self.client.post(get_massadmin_url(self.models, self.client.session),
+                                    {"_mass_change": "name", "name": "new name"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(CustomAdminModel.objects.filter(name="new name").count(), 5)
+
+    def test_invalid_object_in_later_chunk(self):
+        response = self.client.post(get_massadmin_url(self.models, self.client.session),
+                                    {"_mass_change": "name",
+                                     "name": "invalid {}".format(self.models[2].pk)})
+        self.assertContains(response, "Invalid model name")
+        new_names = CustomAdminModel.objects.order_by("pk").values_list("name", flat=True)
+        self.assertEqual(list(new_names), [m.name for m in self.models])
+
+
+class MassChangeLogTest(TestCase):
+    """ Admin log entries are written in batches """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+        self.models = [CustomAdminModel.objects.create(name="model {}".format(i))
+                       for i in range(0, 5)]
+
+    def post(self):
+        response = self.client.post(get_massadmin_url(self.models, self.client.session),
+                                    {"_mass_change": "name", "name": "new name"})
+        self.assertEqual(response.status_code, 302)
+
+    def test_one_entry_per_object(self):
+        with mock.patch.object(massadmin_settings, "CHUNK_SIZE", 2), \
+                mock.patch.object(LogEntry.objects, "bulk_create",
+                                  side_effect=LogEntry.objects.bulk_create) as bulk_create:
+            self.post()
+        self.assertEqual(bulk_create.call_count, 3)
+        entries = LogEntry.objects.order_by("object_id")
+        self.assertEqual(
+            sorted(int(e.object_id) for e in entries), [m.pk for m in self.models])
+        for entry in entries:
+            self.assertEqual(entry.user, self.user)
+            self.assertEqual(entry.action_flag, CHANGE)
+            self.assertEqual(entry.get_change_message(), "Changed Name.")
+
+    @mock.patch.object(CustomAdmin, "massadmin_log_mode", "summary", create=True)
+    def test_summary_entry(self):
+        self.post()
+        entry = LogEntry.objects.get()
+        self.assertEqual(entry.object_repr, "5 custom admin models: Name")
+        self.assertEqual(
+            list(selection.parse_pk_list(entry.object_id)), [m.pk for m in self.models])
+        self.assertEqual(entry.get_change_message(), "Changed Name.")
+
+    def test_inline_changes_are_logged_per_object(self):
+        data = {
+            "_mass_change": ["name", "inheritedadminmodel_set"],
+            "name": "new name",
+            "inheritedadminmodel_set-TOTAL_FORMS": "1",
+            "inheritedadminmodel_set-INITIAL_FORMS": "0",
+            "inheritedadminmodel_set-0-name": "child",
+        }
+        self.client.post(get_massadmin_url(self.models, self.client.session), data)
+        self.assertEqual(LogEntry.objects.count(), 5)
+        for entry in LogEntry.objects.all():
+            self.assertIn("Added inherited admin model", entry.get_change_message())
+
+    @mock.patch.object(ProductAdmin, "massadmin_job_mode", True, create=True)
+    def test_job_entries(self):
+        products = [ProductModel.objects.create(name="product {}".format(i))
+                    for i in range(0, 5)]
+        self.client.post(get_massadmin_url(products, self.client.session),
+                         {"_mass_change": "name", "name": "new name"})
+        self.assertEqual(LogEntry.objects.count(), 0)
+        call_command("massadmin_worker", once=True, stdout=mock.MagicMock())
+        self.assertEqual(LogEntry.objects.filter(user=self.user).count(), 5)
+
+
+class BulkM2MTest(TestCase):
+    """ Many-to-many fields are written for the whole selection at once """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+        self.tags = [TagModel.objects.create(name="tag {}".format(i)) for i in range(0, 3)]
+        self.models = [TaggedAdminModel.objects.create(name="model {}".format(i))
+                       for i in range(0, 5)]
+        for model in self.models:
+            model.tags.set([self.tags[0]])
+
+    def post(self, url_getter, mode=None):
+        data = {"_mass_change": "tags", "tags": [self.tags[1].pk, self.tags[2].pk]}
+        if mode:
+            data["_m2m_mode_tags"] = mode
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url_getter(self.models, self.client.session), data)
+        self.assertEqual(response.status_code, 302)
+        return [q["sql"] for q in queries.captured_queries
+                if "tests_taggedadminmodel_tags" in q["sql"]
+                and not q["sql"].startswith("SELECT")]
+
+    def assertTags(self, tags):
+        for model in self.models:
+            self.assertEqual(list(model.tags.order_by("pk")), tags)
+
+    def test_replace(self):
+        through_queries = self.post(get_massadmin_url)
+        self.assertTags(self.tags[1:])
+        # one delete and one insert, not a clear/add pair per object
+        self.assertEqual(len(through_queries), 2)
+
+    def test_add(self):
+        self.post(get_massadmin_url, "add")
+        self.assertTags(self.tags)
+
+    def test_improved_replace(self):
+        self.post(improved_get_massadmin_url, "replace")
+        self.assertTags(self.tags[1:])
+
+    def test_improved_add(self):
+        self.post(improved_get_massadmin_url, "add")
+        self.assertTags(self.tags)
+
+    def test_add_with_m2m_changed_receiver(self):
+        # written through the related manager, so that the receiver is called
+        receiver = mock.MagicMock()
+        m2m_changed.connect(receiver, sender=TaggedAdminModel.tags.through)
+        try:
+            self.post(get_massadmin_url, "add")
+        finally:
+            m2m_changed.disconnect(receiver, sender=TaggedAdminModel.tags.through)
+        self.assertTags(self.tags)
+        self.assertTrue(receiver.called)
+
+    @mock.patch.object(massadmin_settings, "JOB_MODE", True)
+    def test_job_add(self):
+        self.post(get_massadmin_url, "add")
+        self.assertTags([self.tags[0]])
+        call_command("massadmin_worker", once=True, stdout=mock.MagicMock())
+        self.assertTags(self.tags)
+
+    @mock.patch.object(massadmin_settings, "JOB_MODE", True)
+    def test_improved_job_add(self):
+        self.post(improved_get_massadmin_url, "add")
+        self.assertEqual(MassEditJob.objects.get().engine, MassEditJob.ENGINE_BULK)
+        call_command("massadmin_worker", once=True, stdout=mock.MagicMock())
+        self.assertTags(self.tags)
+
+    @mock.patch.object(massadmin_settings, "JOB_MODE", True)
+    def test_job_replace(self):
+        self.post(get_massadmin_url)
+        call_command("massadmin_worker", once=True, stdout=mock.MagicMock())
+        self.assertTags(self.tags[1:])
+
+    def test_chunks(self):
+        bulk_set_m2m(TaggedAdminModel, "tags", [m.pk for m in self.models],
+                     [self.tags[2].pk], mode=M2M_ADD, chunk_size=2)
+        self.assertTags([self.tags[0], self.tags[2]])
+
+    def test_mode_selector(self):
+        response = self.client.get(get_massadmin_url(self.models, self.client.session))
+        self.assertContains(response, 'name="_m2m_mode_tags"')
+
+
+class ChunkSizeTest(TestCase):
+    """ Size of the UPDATE batches of MassAdminImproved """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+
+    @mock.patch.object(massadmin_settings, "UPDATE_CHUNK_SIZE", 2)
+    def test_configured_chunk_size(self):
+        models = [CustomAdminModel.objects.create(name="model {}".format(i))
+                  for i in range(0, 5)]
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(improved_get_massadmin_url(models, self.client.session),
+                             {"_mass_change": "name", "name": "new name"})
+        updates = [q for q in queries.captured_queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(CustomAdminModel.objects.filter(name="new name").count(), 5)
+
+    def test_backend_limit(self):
+        with mock.patch.object(connection.features, "max_query_params", 999):
+            self.assertEqual(get_max_chunk_size(connection, 3), 996)
+            with mock.patch.object(massadmin_settings, "UPDATE_CHUNK_SIZE", 5000):
+                self.assertEqual(get_update_chunk_sizer(connection, 3)(), 996)
+        with mock.patch.object(connection.features, "max_query_params", None):
+            self.assertEqual(get_max_chunk_size(connection), 65535)
+
+    def test_adaptive_chunk_size(self):
+        sizer = AdaptiveChunkSizer(100, target_seconds=1.0, maximum=1000)
+        sizer.record(100, 0.1)
+        self.assertEqual(sizer(), 200)
+        sizer.record(200, 0.7)
+        self.assertEqual(sizer(), 200)
+        sizer.record(200, 4.0)
+        self.assertEqual(sizer(), 50)
+        # a short last chunk doesn't change the size
+        sizer.record(3, 0.001)
+        self.assertEqual(sizer(), 50)
+        for i in range(0, 10):
+            sizer.record(sizer(), 0.0)
+        self.assertEqual(sizer(), 1000)
+        for i in range(0, 10):
+            sizer.record(sizer(), 100.0)
+        self.assertEqual(sizer(), 10)
+
+    def test_variable_chunks(self):
+        sizes = iter([1, 2, 3])
+        chunks = list(selection.iter_pk_chunks(list(range(0, 6)), lambda: next(sizes)))
+        self.assertEqual(chunks, [[0], [1, 2], [3, 4, 5]])
+
+    @mock.patch.object(massadmin_settings, "ADAPTIVE_CHUNK_SIZE", True)
+    def test_adaptive_update(self):
+        models = [CustomAdminModel.objects.create(name="model {}".format(i))
+                  for i in range(0, 5)]
+        response = self.client.post(improved_get_massadmin_url(models, self.client.session),
+                                    {"_mass_change": "name", "name": "new name"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(CustomAdminModel.objects.filter(name="new name").count(), 5)
+
+
+class PkFilterTest(TestCase):
+    """ Chunks of the selection are matched with ranges or with the selection's filter """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+
+    def test_ranges(self):
+        pk_filter = selection.get_pk_filter([7, 1, 2, 3, 4, 9, 10, 20, 21, 22])
+        self.assertEqual(
+            pk_filter,
+            Q(pk__range=(1, 4)) | Q(pk__range=(20, 22)) | Q(pk__in=[7, 9, 10]))
+        self.assertEqual(selection.get_pk_filter(["1", "2", "3"]), Q(pk__in=["1", "2", "3"]))
+
+    def test_update_uses_ranges(self):
+        models = [CustomAdminModel.objects.create(name="model {}".format(i))
+                  for i in range(0, 100)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(improved_get_massadmin_url(models, self.client.session),
+                                        {"_mass_change": "name", "name": "new name"})
+        self.assertEqual(response.status_code, 302)
+        update, = [q["sql"] for q in queries.captured_queries if q["sql"].startswith("UPDATE")]
+        self.assertIn("BETWEEN", update)
+        self.assertNotIn(" IN (", update)
+        self.assertEqual(CustomAdminModel.objects.filter(name="new name").count(), 100)
+
+    @mock.patch.object(massadmin_settings, "UPDATE_CHUNK_SIZE", 2)
+    @mock.patch.object(CustomAdmin, "actions", (improved_mass_change_selected, ))
+    def test_query_selection_windows(self):
+        models = [CustomAdminModel.objects.create(name="model {}".format(i))
+                  for i in range(0, 5)]
+        CustomAdminModel.objects.create(name="other")
+        response = self.client.post(
+            get_changelist_url(CustomAdminModel) + "?name__startswith=model",
+            {"action": "mass_change_selected",
+             "select_across": "1",
+             "_selected_action": models[0].pk})
+        self.assertIn("/query-", response.url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(response.url, {"_mass_change": "name", "name": "new name"})
+        self.assertEqual(response.status_code, 302)
+        updates = [q["sql"] for q in queries.captured_queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 3)
+        # the selection's filter is applied by the database, pks are not sent back
+        for update in updates:
+            self.assertIn("LIKE", update)
+        self.assertEqual(CustomAdminModel.objects.filter(name="new name").count(), 5)
+        self.assertEqual(CustomAdminModel.objects.filter(name="other").count(), 1)
+
+
+def auto_get_massadmin_url(objects, session):
+    opts = objects[0]._meta
+    return auto_get_mass_change_redirect_url(opts, [o.pk for o in objects], session)
+
+
+class EngineSelectionTest(TestCase):
+    """ The per-object or the bulk engine is chosen for every edit """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+        self.models = [TaggedAdminModel.objects.create(name="model {}".format(i))
+                       for i in range(0, 5)]
+
+    def select(self, model, fields):
+        admin_obj = admin.site._registry[model]
+        request = RequestFactory().get("/")
+        request.user = self.user
+        return select_engine(admin_obj, model, admin_obj.get_form(request), fields)
+
+    def post(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(auto_get_massadmin_url(self.models, self.client.session),
+                                        {"_mass_change": "name", "name": "new name"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(TaggedAdminModel.objects.filter(name="new name").count(), 5)
+        return [q["sql"] for q in queries.captured_queries if q["sql"].startswith("UPDATE")]
+
+    def test_bulk(self):
+        self.assertEqual(self.select(TaggedAdminModel, ["name", "tags"]), (ENGINE_BULK, []))
+        self.assertEqual(len(self.post()), 1)
+
+    def test_instance_dependent_validation(self):
+        engine, reasons = self.select(CustomAdminModel, ["name"])
+        self.assertEqual(engine, ENGINE_CLASSIC)
+        self.assertEqual(reasons, ["CustomAdminModelForm defines clean_name()"])
+
+    def test_inline(self):
+        engine, reasons = self.select(TaggedAdminModel, ["name", "inheritedadminmodel_set"])
+        self.assertEqual(engine, ENGINE_CLASSIC)
+        self.assertEqual(reasons, ["inheritedadminmodel_set is not a model field"])
+
+    def test_receivers(self):
+        def receiver(**kwargs):
+            pass
+        post_save.connect(receiver, sender=TaggedAdminModel)
+        try:
+            with self.assertLogs("massadmin.engines", "INFO") as logs:
+                self.assertEqual(len(self.post()), 5)
+        finally:
+            post_save.disconnect(receiver, sender=TaggedAdminModel)
+        self.assertIn("uses the classic engine: post_save receivers are connected", logs.output[0])
+
+    @mock.patch.object(massadmin_settings, "JOB_MODE", True)
+    def test_engine_is_chosen_once(self):
+        def clean(self):
+            pass
+        with mock.patch.object(TaggedAdminModel, "clean", clean):
+            with self.assertLogs("massadmin.engines", "INFO") as logs:
+                self.assertEqual(len(self.post()), 5)
+        # asked by use_job_mode, which doesn't queue it, then by edit_all_values
+        self.assertEqual(len(logs.output), 1)
+
+    def test_save_override(self):
+        def save(self, *args, **kwargs):
+            super(TaggedAdminModel, self).save(*args, **kwargs)
+        with mock.patch.object(TaggedAdminModel, "save", save):
+            engine, reasons = self.select(TaggedAdminModel, ["name"])
+        self.assertEqual(reasons, ["TaggedAdminModel overrides save()"])
+
+    def test_auto_now(self):
+        engine, reasons = self.select(ProductModel, ["name"])
+        self.assertEqual(engine, ENGINE_CLASSIC)
+        self.assertEqual(reasons, ["updated_at has auto_now"])
+
+    def test_forced_engine(self):
+        admin_class = type(admin.site._registry[TaggedAdminModel])
+        with mock.patch.object(admin_class, "massadmin_engine", "classic", create=True):
+            self.assertEqual(len(self.post()), 5)
+
+
+class MassUpdateSignalTest(TestCase):
+    """ The bulk engine sends a pair of signals per chunk """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+        self.tags = [TagModel.objects.create(name="tag {}".format(i)) for i in range(0, 2)]
+        self.models = [TaggedAdminModel.objects.create(name="model {}".format(i))
+                       for i in range(0, 5)]
+        self.calls = []
+        mass_pre_update.connect(self.pre_update, sender=TaggedAdminModel)
+        mass_post_update.connect(self.post_update, sender=TaggedAdminModel)
+
+    def tearDown(self):
+        mass_pre_update.disconnect(self.pre_update, sender=TaggedAdminModel)
+        mass_post_update.disconnect(self.post_update, sender=TaggedAdminModel)
+
+    def pre_update(self, sender, pks, fields, values, using, **kwargs):
+        # nothing is written yet
+        self.assertEqual(TaggedAdminModel.objects.filter(pk__in=pks, name="new name").count(), 0)
+        self.calls.append(("pre", sorted(pks), sorted(fields)))
+
+    def post_update(self, sender, pks, fields, values, using, **kwargs):
+        self.assertEqual(
+            TaggedAdminModel.objects.filter(pk__in=pks, name="new name").count(), len(pks))
+        self.assertEqual(values["tags"], [self.tags[1].pk])
+        self.calls.append(("post", sorted(pks), sorted(fields)))
+
+    def assertCalls(self):
+        pks = [m.pk for m in self.models]
+        fields = ["name", "tags"]
+        self.assertEqual(self.calls, [
+            ("pre", pks[0:2], fields), ("post", pks[0:2], fields),
+            ("pre", pks[2:4], fields), ("post", pks[2:4], fields),
+            ("pre", pks[4:], fields), ("post", pks[4:], fields),
+        ])
+
+    @mock.patch.object(massadmin_settings, "UPDATE_CHUNK_SIZE", 2)
+    def test_improved(self):
+        response = self.client.post(
+            improved_get_massadmin_url(self.models, self.client.session),
+            {"_mass_change": ["name", "tags"], "name": "new name", "tags": [self.tags[1].pk]})
+        self.assertEqual(response.status_code, 302)
+        self.assertCalls()
+
+    def test_bulk_job(self):
+        model_admin = admin.site._registry[TaggedAdminModel]
+        request = RequestFactory().get("/")
+        request.user = self.user
+        form = model_admin.get_form(request)(
+            {"name": "new name", "tags": [self.tags[1].pk]}, instance=self.models[0])
+        self.assertTrue(form.is_valid())
+        enqueue_job(TaggedAdminModel, [m.pk for m in self.models], form.cleaned_data,
+                    engine=MassEditJob.ENGINE_BULK)
+        call_command("massadmin_worker", once=True, chunk_size=2, stdout=mock.MagicMock())
+        self.assertCalls()
+
+    def test_not_sent_by_classic_engine(self):
+        self.client.post(get_massadmin_url(self.models, self.client.session),
+                         {"_mass_change": "name", "name": "new name"})
+        self.assertEqual(self.calls, [])
+
+    def test_engine_selection(self):
+        admin_obj = admin.site._registry[TaggedAdminModel]
+
+        def receiver(**kwargs):
+            pass
+        post_save.connect(receiver, sender=TaggedAdminModel)
+        try:
+            with mock.patch.object(type(admin_obj), "massadmin_bulk_signals", True, create=True):
+                engine, reasons = select_engine(
+                    admin_obj, TaggedAdminModel, admin_obj.form, ["name"])
+        finally:
+            post_save.disconnect(receiver, sender=TaggedAdminModel)
+        self.assertEqual(engine, ENGINE_BULK)
+
+
+def permitted_queryset(self, request, queryset):
+    return queryset.exclude(name__startswith="locked")
+
+
+@mock.patch.object(CustomAdmin, "massadmin_permitted_queryset", permitted_queryset, create=True)
+class PermittedQuerysetTest(TestCase):
+    """ Permissions of the whole selection are checked with a queryset """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+        self.models = [CustomAdminModel.objects.create(name="model {}".format(i))
+                       for i in range(0, 5)]
+
+    def test_permitted(self):
+        response = self.client.post(get_massadmin_url(self.models, self.client.session),
+                                    {"_mass_change": "name", "name": "new name"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(CustomAdminModel.objects.filter(name="new name").count(), 5)
+
+    def test_forbidden_object(self):
+        locked = CustomAdminModel.objects.create(name="locked")
+        url = get_massadmin_url(self.models + [locked], self.client.session)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        response = self.client.post(url, {"_mass_change": "name", "name": "new name"})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(CustomAdminModel.objects.filter(name="new name").count(), 0)
+
+    def test_one_query(self):
+        locked = [CustomAdminModel.objects.create(name="locked {}".format(i))
+                  for i in range(0, 20)]
+        ma = MassAdmin(CustomAdminModel, admin.site)
+        queryset = CustomAdminModel.objects.all()
+        pks = array("q", sorted(m.pk for m in self.models + locked))
+        with self.assertNumQueries(1):
+            forbidden_ids = ma.get_forbidden_ids(
+                queryset, ma.get_permitted_queryset(None, queryset), pks)
+        self.assertEqual(forbidden_ids, [m.pk for m in locked[:10]])
+
+
+class SelectionCountTest(TestCase):
+    """ Selected objects that don't exist are counted and reported up front """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+        self.models = [CustomAdminModel.objects.create(name="model {}".format(i))
+                       for i in range(0, 5)]
+
+    def test_count(self):
+        queryset = CustomAdminModel.objects.all()
+        pks = [m.pk for m in self.models]
+        with self.assertNumQueries(1):
+            self.assertEqual(selection.count_selection(queryset, pks, 500, 10), (5, 5, []))
+        self.models[1].delete()
+        self.models[3].delete()
+        self.assertEqual(
+            selection.count_selection(queryset, pks + [1000], 2, 10),
+            (3, 6, [pks[1], pks[3], 1000]))
+        self.assertEqual(
+            selection.count_selection(queryset, pks + [1000], 2, 1), (3, 6, [pks[1]]))
+
+    def test_missing_objects(self):
+        url = get_massadmin_url(self.models, self.client.session)
+        missing_pk = self.models[0].pk
+        self.models[0].delete()
+        response = self.client.get(url)
+        self.assertContains(response, "4 of 5 selected objects will be edited.")
+        self.assertContains(response, "Not found: {}".format(missing_pk))
+        response = self.client.post(url, {"_mass_change": "name", "name": "new name"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(CustomAdminModel.objects.filter(name="new name").count(), 4)
+
+    def test_improved_missing_first_object(self):
+        url = improved_get_massadmin_url(self.models, self.client.session)
+        self.models[0].delete()
+        response = self.client.post(url, {"_mass_change": "name", "name": "new name"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(CustomAdminModel.objects.filter(name="new name").count(), 4)
+
+    def test_nothing_left(self):
+        url = get_massadmin_url(self.models, self.client.session)
+        CustomAdminModel.objects.all().delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class ModelMetadataCacheTest(TestCase):
+    """ Field metadata and MassAdmin objects are built once per admin site and model """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+        metadata_cache.cache_clear()
+
+    def tearDown(self):
+        metadata_cache.cache_clear()
+
+    def test_hits_and_misses(self):
+        metadata = metadata_cache.get_model_metadata(admin.site, User)
+        self.assertIn("username", metadata.unique_fields)
+        self.assertNotIn("username", metadata.editable_fields)
+        self.assertIn("first_name", metadata.editable_fields)
+        self.assertEqual(metadata.m2m_fields, {"groups", "user_permissions"})
+        self.assertIs(metadata_cache.get_model_metadata(admin.site, User), metadata)
+        self.assertEqual(metadata_cache.cache_info()["metadata"], (1, 1, 0, 1))
+
+        url = get_massadmin_url(self.user, self.client.session)
+        self.client.get(url)
+        self.client.get(url)
+        self.assertEqual(metadata_cache.cache_info()["metadata"], (3, 1, 0, 1))
+        # the MassAdmin object is prepared once too
+        self.assertEqual(metadata_cache.cache_info()["mass_admin"], (1, 1, 0, 1))
+
+    def test_reregistration(self):
+        site = CustomAdminSite()
+        site.register(CustomAdminModel, CustomAdmin)
+        metadata = metadata_cache.get_model_metadata(site, CustomAdminModel)
+        self.assertEqual(metadata.exclude_fields, set())
+
+        class ExcludingAdmin(CustomAdmin):
+            massadmin_exclude = ["name"]
+        site.unregister(CustomAdminModel)
+        site.register(CustomAdminModel, ExcludingAdmin)
+        metadata = metadata_cache.get_model_metadata(site, CustomAdminModel)
+        self.assertEqual(metadata.exclude_fields, {"name"})
+        self.assertEqual(metadata_cache.cache_info()["metadata"], (0, 2, 1, 1))
+
+        mass_admin = metadata_cache.get_mass_admin(MassAdminImproved, site, CustomAdminModel)
+        self.assertIsInstance(mass_admin.admin_obj, ExcludingAdmin)
+        site.unregister(CustomAdminModel)
+        site.register(CustomAdminModel, CustomAdmin)
+        mass_admin = metadata_cache.get_mass_admin(MassAdminImproved, site, CustomAdminModel)
+        self.assertIsInstance(mass_admin.admin_obj, CustomAdmin)
+        self.assertNotIsInstance(mass_admin.admin_obj, ExcludingAdmin)
+
+        metadata_cache.invalidate(site)
+        self.assertEqual(metadata_cache.cache_info()["metadata"].size, 0)
+        self.assertEqual(metadata_cache.cache_info()["mass_admin"].size, 0)
+
+    def test_unique_fields_are_not_changed(self):
+        other = User.objects.create_user("other", "other@gmail.com", "other")
+        response = self.client.get(get_massadmin_url([self.user, other], self.client.session))
+        self.assertContains(response, "username is unique.")
+        response = self.client.post(get_massadmin_url([self.user, other], self.client.session),
+                                    {"_mass_change": ["username", "first_name"],
+                                     "username": "same", "first_name": "Same"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            list(User.objects.order_by("pk").values_list("username", "first_name")),
+            [("temporary", "Same"), ("other", "Same")])
+
+
+@mock.patch.object(massadmin_settings, "LARGE_RELATION_THRESHOLD", 2)
+class RelationWidgetTest(TestCase):
+    """ Relations to large tables don't render a select of every related object """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+        self.tags = [TagModel.objects.create(name="tag {}".format(i)) for i in range(0, 3)]
+        self.models = [TaggedAdminModel.objects.create(name="model {}".format(i))
+                       for i in range(0, 2)]
+
+    def get(self):
+        return self.client.get(get_massadmin_url(self.models, self.client.session))
+
+    def test_raw_id_widget(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get()
+        self.assertContains(response, "vManyToManyRawIdAdminField")
+        self.assertNotContains(response, '<option value="{}">'.format(self.tags[0].pk))
+        count, = [q["sql"] for q in queries.captured_queries
+                  if "COUNT" in q["sql"] and "tests_tagmodel" in q["sql"]]
+        self.assertIn("LIMIT 3", count)
+
+    def test_autocomplete_widget(self):
+        with mock.patch.object(type(admin.site._registry[TagModel]), "search_fields", ("name", )):
+            response = self.get()
+        self.assertContains(response, "admin-autocomplete")
+
+    def test_small_table(self):
+        TagModel.objects.filter(pk=self.tags[0].pk).delete()
+        response = self.get()
+        self.assertContains(response, '<option value="{}">'.format(self.tags[1].pk))
+
+    def test_update(self):
+        response = self.client.post(
+            get_massadmin_url(self.models, self.client.session),
+            {"_mass_change": "tags", "tags": "{},{}".format(self.tags[0].pk, self.tags[2].pk)})
+        self.assertEqual(response.status_code, 302)
+        for model in self.models:
+            self.assertEqual(list(model.tags.order_by("pk")), [self.tags[0], self.tags[2]])
+
+
+class BulkInlineTest(TestCase):
+    """ Inline rows are added to, or updated for, all selected objects at once """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+        self.models = [CustomAdminModel.objects.create(name="model {}".format(i))
+                       for i in range(0, 5)]
+        self.other = CustomAdminModel.objects.create(name="other")
+
+    def post(self, url_getter, data, total_forms=0):
+        data = dict({
+            "_mass_change": ["name", "inheritedadminmodel_set"],
+            "_bulk_inline": "inheritedadminmodel_set",
+            "name": "new name",
+            "inheritedadminmodel_set-TOTAL_FORMS": str(total_forms),
+            "inheritedadminmodel_set-INITIAL_FORMS": "0",
+            "inheritedadminmodel_set-MIN_NUM_FORMS": "0",
+            "inheritedadminmodel_set-MAX_NUM_FORMS": "1000",
+        }, **data)
+        with mock.patch.object(MassAdmin, "save_formset") as save_formset:
+            response = self.client.post(url_getter(self.models, self.client.session), data)
+        self.assertEqual(save_formset.call_count, 0)
+        return response
+
+    def assertChildren(self, names):
+        for model in self.models:
+            self.assertEqual(
+                list(model.inheritedadminmodel_set.order_by("name").values_list("name", flat=True)),
+                names)
+
+    def test_add_rows(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(get_massadmin_url, {
+                "inheritedadminmodel_set-0-name": "child 1",
+                "inheritedadminmodel_set-1-name": "child 2",
+            }, total_forms=2)
+        self.assertEqual(response.status_code, 302)
+        self.assertChildren(["child 1", "child 2"])
+        self.assertFalse(self.other.inheritedadminmodel_set.exists())
+        inserts = [q for q in queries.captured_queries
+                   if q["sql"].startswith('INSERT INTO "tests_inheritedadminmodel"')]
+        self.assertEqual(len(inserts), 1)
+
+    def test_improved_add_rows(self):
+        response = self.post(improved_get_massadmin_url, {
+            "inheritedadminmodel_set-0-name": "child",
+        }, total_forms=1)
+        self.assertEqual(response.status_code, 302)
+        self.assertChildren(["child"])
+        self.assertEqual(CustomAdminModel.objects.filter(name="new name").count(), 5)
+
+    def test_update_children(self):
+        for model in self.models + [self.other]:
+            model.inheritedadminmodel_set.create(name="old")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(get_massadmin_url, {
+                "_bulk_inline_update_inheritedadminmodel_set": "name",
+                "inheritedadminmodel_set-__all__-name": "updated",
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertChildren(["updated"])
+        self.assertEqual(list(self.other.inheritedadminmodel_set.values_list("name", flat=True)),
+                         ["old"])
+        updates = [q for q in queries.captured_queries
+                   if q["sql"].startswith('UPDATE "tests_inheritedadminmodel"')]
+        self.assertEqual(len(updates), 1)
+
+    def test_invalid_update(self):
+        for model in self.models:
+            model.inheritedadminmodel_set.create(name="old")
+        response = self.post(get_massadmin_url, {
+            "_bulk_inline_update_inheritedadminmodel_set": "name",
+            "inheritedadminmodel_set-__all__-name": "x" * 40,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Ensure this value has at most 32 characters")
+        self.assertChildren(["old"])
+        self.assertFalse(CustomAdminModel.objects.filter(name="new name").exists())
+
+    def login_with_view_permission(self):
+        staff = User.objects.create_user('staff', 'staff@gmail.com', 'staff', is_staff=True)
+        staff.user_permissions.set(Permission.objects.filter(
+            codename__in=["view_customadminmodel", "change_customadminmodel",
+                          "view_inheritedadminmodel"]))
+        self.client.login(username='staff', password='staff')
+
+    def test_update_needs_change_permission(self):
+        for model in self.models:
+            model.inheritedadminmodel_set.create(name="old")
+        self.login_with_view_permission()
+        for url_getter in (get_massadmin_url, improved_get_massadmin_url):
+            response = self.post(url_getter, {
+                "_bulk_inline_update_inheritedadminmodel_set": "name",
+                "inheritedadminmodel_set-__all__-name": "updated",
+            })
+            self.assertContains(response, "You are not allowed to change")
+            self.assertChildren(["old"])
+        self.assertFalse(CustomAdminModel.objects.filter(name="new name").exists())
+
+    def test_new_rows_need_add_permission(self):
+        self.login_with_view_permission()
+        for url_getter in (get_massadmin_url, improved_get_massadmin_url):
+            response = self.post(url_getter, {
+                "inheritedadminmodel_set-0-name": "child",
+            }, total_forms=1)
+            self.assertContains(response, "You are not allowed to add")
+            self.assertChildren([])
+
+
+class ExpressionEditTest(TestCase):
+    """ MassAdminImproved computes new values from the current ones in the database """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+        self.products = [
+            ProductModel.objects.create(
+                name="product {}".format(i), price=Decimal("10.00") * (i + 1), stock=i)
+            for i in range(0, 3)]
+
+    def post(self, data, url_getter=improved_get_massadmin_url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url_getter(self.products, self.client.session), data)
+        self.assertEqual(response.status_code, 302)
+        # objects are not loaded, besides the first one used for validation
+        selects = [q for q in queries.captured_queries
+                   if q["sql"].startswith('SELECT "tests_productmodel"."id", ')]
+        self.assertLessEqual(len(selects), 2)
+        return [q["sql"] for q in queries.captured_queries if q["sql"].startswith("UPDATE")]
+
+    def values(self, field):
+        return list(ProductModel.objects.order_by("pk").values_list(field, flat=True))
+
+    def test_form_offers_operators(self):
+        url = improved_get_massadmin_url(self.products, self.client.session)
+        response = self.client.get(url)
+        self.assertContains(response, 'name="_mass_op_stock"')
+        self.assertContains(response, '<option value="multiply">')
+        self.assertContains(response, '<option value="append">')
+        response = self.client.get(get_massadmin_url(self.products, self.client.session))
+        self.assertNotContains(response, "_mass_op_")
+
+    def test_add(self):
+        updates = self.post({"_mass_change": "stock", "stock": "10", "_mass_op_stock": "add"})
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(self.values("stock"), [10, 11, 12])
+
+    def test_multiply(self):
+        self.post({"_mass_change": "price", "price": "1.05", "_mass_op_price": "multiply"})
+        self.assertEqual(self.values("price"),
+                         [Decimal("10.50"), Decimal("21.00"), Decimal("31.50")])
+
+    def test_append_and_prepend(self):
+        self.post({"_mass_change": "name", "name": " (old)", "_mass_op_name": "append"})
+        self.post({"_mass_change": "name", "name": "old ", "_mass_op_name": "prepend"})
+        self.assertEqual(self.values("name"),
+                         ["old product {} (old)".format(i) for i in range(0, 3)])
+
+    def test_replace(self):
+        self.post({"_mass_change": "name", "name": "item",
+                   "_mass_op_name": "replace", "_mass_op_find_name": "product"})
+        self.assertEqual(self.values("name"), ["item {}".format(i) for i in range(0, 3)])
+
+    def test_set(self):
+        self.post({"_mass_change": "stock", "stock": "5", "_mass_op_stock": "set"})
+        self.assertEqual(self.values("stock"), [5, 5, 5])
+
+    def test_blank_operand_is_refused(self):
+        ProductModel.objects.update(discount=5)
+        url = improved_get_massadmin_url(self.products, self.client.session)
+        response = self.client.post(
+            url, {"_mass_change": "discount", "discount": "", "_mass_op_discount": "add"})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "needs a value")
+        self.assertEqual(self.values("discount"), [5, 5, 5])
+        # a blank value can still be set
+        self.post({"_mass_change": "discount", "discount": "", "_mass_op_discount": "set"})
+        self.assertEqual(self.values("discount"), [None, None, None])
+
+    def test_operator_of_another_field_type_is_ignored(self):
+        self.post({"_mass_change": "stock", "stock": "5", "_mass_op_stock": "append"})
+        self.assertEqual(self.values("stock"), [5, 5, 5])
+
+    def test_classic_engine_ignores_operators(self):
+        self.post({"_mass_change": "stock", "stock": "5", "_mass_op_stock": "add"},
+                  url_getter=get_massadmin_url)
+        self.assertEqual(self.values("stock"), [5, 5, 5])
+
+
+class CsvUpdateTest(TestCase):
+    """ Values of every object read from an uploaded CSV/TSV file """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+        self.products = [
+            ProductModel.objects.create(name="product {}".format(i), stock=i)
+            for i in range(0, 4)]
+
+    def upload(self, content, name="values.csv", objects=None, url_getter=get_massadmin_url,
+               encoding="utf-8"):
+        url = url_getter(objects or self.products, self.client.session)
+        return self.client.post(url, {
+            "_mass_csv": SimpleUploadedFile(name, content.encode(encoding), "text/csv")})
+
+    def values(self, field):
+        return list(ProductModel.objects.order_by("pk").values_list(field, flat=True))
+
+    def test_rows_set_their_own_values(self):
+        p = self.products
+        content = "pk,price,stock\n{},1.50,10\n{},2.50,\n{},,30\n".format(
+            p[0].pk, p[1].pk, p[2].pk)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.upload(content)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.values("price"),
+                         [Decimal("1.50"), Decimal("2.50"), Decimal("0"), Decimal("0")])
+        self.assertEqual(self.values("stock"), [10, 1, 30, 3])
+        updates = [q for q in queries.captured_queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+
+    def test_tsv_and_chunks(self):
+        content = "id\tname\n" + "".join(
+            "{}\trenamed {}\n".format(p.pk, i) for i, p in enumerate(self.products))
+        with mock.patch.object(massadmin_settings, "UPDATE_CHUNK_SIZE", 3):
+            with CaptureQueriesContext(connection) as queries:
+                self.upload(content, name="values.tsv", url_getter=improved_get_massadmin_url)
+        self.assertEqual(self.values("name"), ["renamed {}".format(i) for i in range(0, 4)])
+        updates = [q for q in queries.captured_queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 2)
+
+    def test_distinct_values_are_validated_once(self):
+        content = "pk,stock\n" + "".join("{},7\n".format(p.pk) for p in self.products)
+        with mock.patch.object(csv_update.Column, "_clean", autospec=True,
+                               side_effect=csv_update.Column._clean) as clean:
+            self.upload(content)
+        self.assertEqual(clean.call_count, 1)
+        self.assertEqual(self.values("stock"), [7, 7, 7, 7])
+
+    def test_unselected_rows_are_skipped(self):
+        p = self.products
+        content = "pk,stock\n{},10\n{},20\n".format(p[0].pk, p[1].pk)
+        self.upload(content, objects=p[1:])
+        self.assertEqual(self.values("stock"), [0, 20, 2, 3])
+
+    def test_invalid_value_rolls_back(self):
+        content = "pk,stock\n{},10\n{},many\n".format(self.products[0].pk, self.products[1].pk)
+        response = self.upload(content)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Line 3, column &quot;stock&quot;")
+        self.assertEqual(self.values("stock"), [0, 1, 2, 3])
+
+    def test_unknown_column(self):
+        response = self.upload("pk,colour\n{},red\n".format(self.products[0].pk))
+        self.assertContains(response, "The column &quot;colour&quot; is not a field")
+
+    def test_history(self):
+        p = self.products
+        self.upload("pk,price,stock\n{},1.50,10\n{},,20\n".format(p[0].pk, p[2].pk))
+        entries = LogEntry.objects.order_by("object_id")
+        self.assertEqual([entry.object_id for entry in entries], [str(p[0].pk), str(p[2].pk)])
+        self.assertEqual(entries[0].get_change_message(), "Changed Price and Stock.")
+
+    @mock.patch.object(massadmin_settings, "LOG_MODE", "summary")
+    def test_summary_history(self):
+        content = "pk,stock\n" + "".join("{},7\n".format(p.pk) for p in self.products)
+        self.upload(content)
+        entry = LogEntry.objects.get()
+        self.assertEqual(entry.object_repr, "4 product models: Stock")
+
+    def test_admin_validation_is_not_skipped(self):
+        model = CustomAdminModel.objects.create(name="model")
+        response = self.upload("pk,name\n{},invalid {}\n".format(model.pk, model.pk),
+                               objects=[model])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "CustomAdminModelForm defines clean_name()")
+        model.refresh_from_db()
+        self.assertEqual(model.name, "model")
+
+    def test_other_encoding(self):
+        response = self.upload("pk,name\n{},café\n".format(self.products[0].pk),
+                               encoding="latin-1")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "The file must be encoded in UTF-8.")
+        self.assertEqual(self.values("name")[0], "product 0")
+
+    def test_malformed_file(self):
+        limit = csv.field_size_limit(100)
+        try:
+            response = self.upload("pk,name\n{},{}\n".format(self.products[0].pk, "x" * 101))
+        finally:
+            csv.field_size_limit(limit)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Line 2: ")
+        self.assertEqual(self.values("name")[0], "product 0")
+
+
+@mock.patch.object(massadmin_settings, "SKIP_UNCHANGED", True)
+class SkipUnchangedTest(TestCase):
+    """ Objects already having the posted values are not written """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+        self.products = [
+            ProductModel.objects.create(name="product {}".format(i), stock=i)
+            for i in range(0, 3)]
+
+    def post(self, data, url_getter):
+        response = self.client.post(
+            url_getter(self.products, self.client.session), data, follow=True)
+        return [str(message) for message in response.context["messages"]]
+
+    def test_bulk_engine_excludes_unchanged_rows(self):
+        with CaptureQueriesContext(connection) as queries:
+            messages = self.post({"_mass_change": "stock", "stock": "1"},
+                                 improved_get_massadmin_url)
+        self.assertEqual(
+            messages,
+            ["2 selected product models were changed successfully, 1 already had these values."])
+        updates = [q["sql"] for q in queries.captured_queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertIn("NOT", updates[0])
+        self.assertEqual(list(ProductModel.objects.values_list("stock", flat=True)), [1, 1, 1])
+
+    def test_operators_are_always_written(self):
+        messages = self.post({"_mass_change": "stock", "stock": "1", "_mass_op_stock": "add"},
+                             improved_get_massadmin_url)
+        self.assertEqual(messages, ["Selected product models were changed successfully."])
+
+    def test_classic_engine_skips_unchanged_objects(self):
+        saved = []
+
+        def receiver(sender, instance, **kwargs):
+            saved.append(instance.pk)
+
+        post_save.connect(receiver, sender=ProductModel)
+        try:
+            messages = self.post({"_mass_change": "stock", "stock": "1"}, get_massadmin_url)
+        finally:
+            post_save.disconnect(receiver, sender=ProductModel)
+        self.assertEqual(
+            messages,
+            ["2 selected product models were changed successfully, 1 already had these values."])
+        self.assertEqual(saved, [self.products[0].pk, self.products[2].pk])
+        self.assertEqual(LogEntry.objects.filter(action_flag=CHANGE).count(), 2)
+
+
+class SharedUploadTest(TestCase):
+    """ An uploaded file is stored once and shared by every edited object """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+        self.products = [
+            ProductModel.objects.create(name="product {}".format(i)) for i in range(0, 3)]
+        self.media_root = tempfile.mkdtemp()
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+    def upload(self, url_getter):
+        response = self.client.post(url_getter(self.products, self.client.session), {
+            "_mass_change": "attachment",
+            "attachment": SimpleUploadedFile("manual.txt", b"read me"),
+        })
+        self.assertEqual(response.status_code, 302)
+        names = set(ProductModel.objects.values_list("attachment", flat=True))
+        self.assertEqual(len(names), 1)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, "attachments")),
+                         [os.path.basename(names.pop())])
+        self.assertEqual(ProductModel.objects.first().attachment.read(), b"read me")
+
+    def test_classic_engine(self):
+        self.upload(get_massadmin_url)
+
+    def test_bulk_engine(self):
+        self.upload(improved_get_massadmin_url)
+
+    def test_files_are_kept_without_upload(self):
+        for product in self.products:
+            product.attachment.save("{}.txt".format(product.name), ContentFile(b"own"))
+        files = list(ProductModel.objects.order_by("pk").values_list("attachment", flat=True))
+        for url_getter in (get_massadmin_url, improved_get_massadmin_url):
+            response = self.client.post(url_getter(self.products, self.client.session), {
+                "_mass_change": ["stock", "attachment"], "stock": "4"})
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(
+                list(ProductModel.objects.order_by("pk").values_list("attachment", flat=True)),
+                files)
+            self.assertEqual(list(ProductModel.objects.values_list("stock", flat=True)), [4] * 3)
+            ProductModel.objects.update(stock=0)
+
+    def test_only_file_without_upload(self):
+        response = self.client.post(improved_get_massadmin_url(self.products, self.client.session),
+                                    {"_mass_change": "attachment"})
+        self.assertEqual(response.status_code, 302)
+
+    def test_bulk_clear(self):
+        for product in self.products:
+            product.attachment.save("{}.txt".format(product.name), ContentFile(b"own"))
+        self.client.post(improved_get_massadmin_url(self.products, self.client.session), {
+            "_mass_change": "attachment", "attachment-clear": "on"})
+        self.assertEqual(set(ProductModel.objects.values_list("attachment", flat=True)), {""})
+
+
+class BenchmarkCommandTest(TestCase):
+    """ The benchmark command measures both engines """
+
+    def test_results(self):
+        out = StringIO()
+        call_command("massadmin_benchmark", sizes=[3], memory=False, test_db=False,
+                     setup_runs=10, stdout=out, stderr=StringIO())
+        report = json.loads(out.getvalue())
+        self.assertEqual(sorted(r["engine"] for r in report["setup"]), ["bulk", "classic"])
+        for result in report["setup"]:
+            self.assertEqual(result["model"], "auth.User")
+            self.assertGreater(result["built_us"], 0)
+        results = report["results"]
+        self.assertEqual(
+            sorted((r["scenario"], r["engine"]) for r in results),
+            [("bulk_inline", "bulk"), ("bulk_inline", "classic"),
+             ("custom_with_inlines", "bulk"), ("custom_with_inlines", "classic"),
+             ("inherited_with_fk", "bulk"), ("inherited_with_fk", "classic"),
+             ("inline_formset", "classic")])
+        for result in results:
+            self.assertEqual(result["rows"], 3)
+            self.assertEqual(result["status_code"], 302)
+            self.assertGreater(result["queries"], 0)
+        self.assertEqual(set(CustomAdminModel.objects.values_list("name", flat=True)),
+                         {"renamed"})
+        # 3 seeded children, then a child per object and inline edit
+        self.assertEqual(InheritedAdminModel.objects.count(), 12)
+        # scenarios run in alphabetical order, bulk_inline renames the children first
+        self.assertEqual(InheritedAdminModel.objects.filter(name="added").count(), 3)
+
+
+class InstrumentationTest(TestCase):
+    """ Mass edits send timing events of their phases """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'temporary', 'temporary@gmail.com', 'temporary')
+        self.client.login(username='temporary', password='temporary')
+        self.products = [
+            ProductModel.objects.create(name="product {}".format(i)) for i in range(0, 3)]
+        self.events = []
+        instrumentation.subscribe(self.events.append)
+        self.addCleanup(instrumentation.unsubscribe, self.events.append)
+
+    def get_events(self, name):
+        return [event for event in self.events if event.name == name]
+
+    def test_classic_engine_phases(self):
+        self.client.post(get_massadmin_url(self.products, self.client.session),
+                         {"_mass_change": "stock", "stock": "5"})
+        self.assertEqual([event.name for event in self.events],
+                         ["decode", "permission", "validation", "write", "log"])
+        for event in self.events:
+            self.assertEqual(event.model, "tests.ProductModel")
+            self.assertEqual(event.rows, 3)
+            self.assertGreaterEqual(event.seconds, 0)
+        self.assertEqual(self.get_events("write")[0].queries, 3)
+
+    def test_bulk_engine_write_chunks(self):
+        with mock.patch.object(massadmin_settings, "UPDATE_CHUNK_SIZE", 2):
+            self.client.post(improved_get_massadmin_url(self.products, self.client.session),
+                             {"_mass_change": "stock", "stock": "5"})
+        self.assertEqual([(event.rows, event.queries) for event in self.get_events("write")],
+                         [(2, 1), (1, 1)])
+        self.assertEqual(self.get_events("validation")[0].rows, 1)
+
+    def test_render_is_measured(self):
+        self.client.get(get_massadmin_url(self.products, self.client.session))
+        self.assertEqual([event.name for event in self.events], ["decode", "permission", "render"])
+
+    def test_default_sink_logs(self):
+        instrumentation.unsubscribe(self.events.append)
+        with self.assertLogs("massadmin.instrumentation", "DEBUG") as logs:
+            self.client.get(get_massadmin_url(self.products, self.client.session))
+        self.assertIn("Mass edit of tests.ProductModel: render took", logs.output[-1])